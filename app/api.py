@@ -2,21 +2,37 @@
 from fastapi.staticfiles import StaticFiles
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import numpy as np, json, os
+import numpy as np, os
+import orjson
 from PIL import Image
-import io
+import base64
+import binascii
+import hashlib
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import time
+import uuid
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional, List
 from app.config import settings
 from app.utils import logger, l2norm_np
 from app.encoder import Encoder
+from app.batcher import MicroBatcher
 from app.weaviate_client import get_weaviate_client, CLASS_NAME, get_collection_name
-from app.deps import get_redis, redis_set_json, redis_get_json
+from app.deps import get_redis, redis_get_json, get_redis_binary, redis_set_vec, redis_get_vec
 import weaviate
+import weaviate.classes as wvc
+import redis
 
 # Cache for model encoders - keep all models loaded
 model_encoders = {}
+# Serializes model loads so concurrent first requests don't load the same model twice
+model_encoders_lock = threading.Lock()
 
 def get_encoder_for_model(model_key):
     """Get or create encoder for specific model (keep all models loaded)"""
@@ -27,15 +43,22 @@ def get_encoder_for_model(model_key):
     if model_key in model_encoders:
         return model_encoders[model_key]
     
-    # Load the requested model (keep existing models in memory)
-    model_id = settings.AVAILABLE_MODELS[model_key]["model_id"]
-    logger.info(f"Loading encoder for {model_key}: {model_id}")
-    model_encoders[model_key] = Encoder(model_name=model_id)
-    logger.info(f"✓ Loaded encoder for {model_key}. Total models loaded: {len(model_encoders)}")
+    with model_encoders_lock:
+        # another request may have loaded it while we waited
+        if model_key in model_encoders:
+            return model_encoders[model_key]
+        # Load the requested model (keep existing models in memory)
+        model_id = settings.AVAILABLE_MODELS[model_key]["model_id"]
+        logger.info(f"Loading encoder for {model_key}: {model_id}")
+        model_encoders[model_key] = Encoder(model_name=model_id)
+        logger.info(f"✓ Loaded encoder for {model_key}. Total models loaded: {len(model_encoders)}")
     
     return model_encoders[model_key]
 
-app = FastAPI(title="Image Retrieval (Multi-Model)")
+# Newer FastAPI serializes response models straight to JSON bytes via Pydantic
+# and deprecates ORJSONResponse, so only install it where that fast path is missing
+_response_opts = {} if getattr(ORJSONResponse, "__deprecated__", None) else {"default_response_class": ORJSONResponse}
+app = FastAPI(title="Image Retrieval (Multi-Model)", **_response_opts)
 
 # Add CORS middleware
 app.add_middleware(
@@ -55,11 +78,54 @@ try:
 except Exception as e:
     logger.warning("Weaviate client not configured: %s", e)
 
-# DON'T preload all models - use lazy loading to save GPU memory
+# DON'T preload all models - only the default one is warmed at startup, the rest load on demand
 logger.info("Models will be loaded on demand (lazy loading to save GPU memory)")
 
 # Redis for session
 r = get_redis()
+rb = get_redis_binary()  # vectors are stored as raw bytes
+
+# Collection handles per name, shared by all requests
+collection_cache = {}
+
+def get_collection(collection_name):
+    """Cached client.collections.get() handle"""
+    collection = collection_cache.get(collection_name)
+    if collection is None:
+        collection = collection_cache.setdefault(collection_name, client.collections.get(collection_name))
+    return collection
+
+# Certainty only exists for cosine indexes, so queries ask for distance and scores are
+# derived from the collection's metric
+SEARCH_METADATA = wvc.query.MetadataQuery(distance=True)
+
+# Distance metric per collection name, read once from its schema
+metric_cache = {}
+
+def distance_metric_of(collection):
+    """Distance metric ("cosine", "dot", "l2-squared") the collection was created with"""
+    metric = metric_cache.get(collection.name)
+    if metric is None:
+        try:
+            metric = collection.config.get().vector_index_config.distance_metric.value
+        except Exception as e:
+            logger.warning("Could not read distance metric of %s, assuming %s: %s",
+                           collection.name, settings.VECTOR_DISTANCE, e)
+            metric = settings.VECTOR_DISTANCE
+        metric_cache[collection.name] = metric
+    return metric
+
+@app.on_event("startup")
+def startup_event():
+    try:
+        seed_analytics()
+    except Exception as e:
+        logger.warning("Failed to seed analytics counters: %s", e)
+    # warm the default model so the first query doesn't pay the load
+    try:
+        get_encoder_for_model("clip-base-p32")
+    except Exception as e:
+        logger.warning("Failed to preload default encoder: %s", e)
 
 @app.on_event("shutdown")
 def shutdown_event():
@@ -70,6 +136,7 @@ class SearchRequest(BaseModel):
     session_id: str
     query_text: str = None
     query_image_vector: list = None
+    query_image_vector_b64: Optional[str] = None  # base64 of raw little-endian float32 bytes (e.g. a Float32Array buffer)
     top_k: int = 20
     user_id: Optional[str] = "anonymous"
     model_key: Optional[str] = "clip-base-p32"  # default model
@@ -87,6 +154,61 @@ class SearchHistoryEntry(BaseModel):
     num_results: int
     top_result_id: Optional[str] = None
 
+# One text micro-batcher per loaded encoder, keyed by model id
+text_batchers = {}
+text_batchers_lock = threading.Lock()
+
+def get_text_batcher(model_encoder):
+    """Batcher that merges concurrent single-query text encodes into one forward pass"""
+    with text_batchers_lock:
+        batcher = text_batchers.get(model_encoder.model_name)
+        if batcher is None:
+            batcher = MicroBatcher(model_encoder.encode_text, max_batch=settings.TEXT_BATCH_MAX,
+                                   max_wait_ms=settings.TEXT_BATCH_WAIT_MS, name=f"text-batcher-{model_encoder.model_name}")
+            text_batchers[model_encoder.model_name] = batcher
+        return batcher
+
+def encode_query_text(model_encoder, text):
+    """Encode query text, reusing the fp16 vector cached in Redis for repeated queries"""
+    # keyed by model id so each model keeps its own vectors; expire after settings.TEXT_VECTOR_TTL
+    key = f"tvec:{model_encoder.model_name}:{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
+    # the cache is optional: a Redis outage falls back to encoding, never fails the search
+    try:
+        cached = redis_get_vec(rb, key)
+    except redis.RedisError as e:
+        logger.warning("Text vector cache read failed: %s", e)
+        cached = None
+    if cached is not None:
+        return cached
+    qv = get_text_batcher(model_encoder)(text)
+    try:
+        redis_set_vec(rb, key, qv, ex=settings.TEXT_VECTOR_TTL)
+    except redis.RedisError as e:
+        logger.warning("Text vector cache write failed: %s", e)
+    return qv
+
+# Common species keywords in text queries -> species property value
+SPECIES_KEYWORDS = {
+    'cat': 'cat', 'cats': 'cat', 'kitten': 'cat', 'feline': 'cat',
+    'dog': 'dog', 'dogs': 'dog', 'puppy': 'dog', 'canine': 'dog',
+    'bird': 'bird', 'birds': 'bird',
+    'horse': 'horse', 'horses': 'horse',
+    'cow': 'cow', 'cows': 'cow', 'cattle': 'cow',
+    'sheep': 'sheep',
+    'elephant': 'elephant', 'elephants': 'elephant',
+    'butterfly': 'butterfly', 'butterflies': 'butterfly'
+}
+SPECIES_RE = re.compile(r"\b(" + "|".join(map(re.escape, SPECIES_KEYWORDS)) + r")\b")
+
+@lru_cache(maxsize=256)
+def species_filter_for(species):
+    """Weaviate filter matching any of a frozenset of species, built once per set"""
+    filters = [wvc.query.Filter.by_property("species").equal(sp) for sp in sorted(species)]
+    return filters[0] if len(filters) == 1 else wvc.query.Filter.any_of(filters)
+
+# Only properties read by pack_results() are requested from Weaviate
+RESULT_PROPERTIES = ["file", "caption", "species"]
+
 @app.post("/search", response_model=SearchResponse)
 def search(req: SearchRequest):
     if client is None:
@@ -97,69 +219,52 @@ def search(req: SearchRequest):
     collection_name = get_collection_name(req.model_key)
     logger.info(f"Search with model: {req.model_key}, collection: {collection_name}")
 
-    if req.query_image_vector is not None:
-        qv = np.asarray(req.query_image_vector, dtype=np.float32)
+    if req.query_image_vector_b64 is not None or req.query_image_vector is not None:
+        if req.query_image_vector_b64 is not None:
+            try:
+                qv = np.frombuffer(base64.b64decode(req.query_image_vector_b64, validate=True), dtype="<f4")
+            except (binascii.Error, ValueError):
+                raise HTTPException(status_code=400, detail="query_image_vector_b64 must be base64 of float32 bytes")
+        else:
+            qv = np.asarray(req.query_image_vector, dtype=np.float32)
+        if qv.shape != (settings.dim_of(req.model_key),):
+            raise HTTPException(status_code=400, detail=f"query_image_vector must have {settings.dim_of(req.model_key)} values for {req.model_key}")
     elif req.query_text:
-        qv = model_encoder.encode_text([req.query_text])[0]
+        qv = encode_query_text(model_encoder, req.query_text)
     else:
-        raise HTTPException(status_code=400, detail="Provide query_text or query_image_vector")
+        raise HTTPException(status_code=400, detail="Provide query_text, query_image_vector or query_image_vector_b64")
     qv = l2norm_np(qv)
 
-    # Extract species from query for filtering
+    # Extract species from query for filtering (one regex scan over the query)
     query_lower = req.query_text.lower() if req.query_text else ""
-    species_filter = None
-    
-    # Common species keywords
-    species_keywords = {
-        'cat': 'cat', 'cats': 'cat', 'kitten': 'cat', 'feline': 'cat',
-        'dog': 'dog', 'dogs': 'dog', 'puppy': 'dog', 'canine': 'dog',
-        'bird': 'bird', 'birds': 'bird',
-        'horse': 'horse', 'horses': 'horse',
-        'cow': 'cow', 'cows': 'cow', 'cattle': 'cow',
-        'sheep': 'sheep',
-        'elephant': 'elephant', 'elephants': 'elephant',
-        'butterfly': 'butterfly', 'butterflies': 'butterfly'
-    }
-    
-    for keyword, species in species_keywords.items():
-        if keyword in query_lower:
-            species_filter = species
-            break
+    m = SPECIES_RE.search(query_lower)
+    species_filter = SPECIES_KEYWORDS[m.group(1)] if m else None
 
     # Weaviate nearVector query with optional species filter
     try:
-        import weaviate.classes as wvc
-        collection = client.collections.get(collection_name)
+        collection = get_collection(collection_name)
         
         # Build query with optional species filter
         if species_filter:
             logger.info(f"Applying species filter: {species_filter}")
             response = collection.query.near_vector(
-                near_vector=qv.tolist(),
+                near_vector=qv,
                 limit=req.top_k,
-                return_metadata=wvc.query.MetadataQuery(certainty=True, distance=True),
-                filters=wvc.query.Filter.by_property("species").equal(species_filter)
+                return_metadata=SEARCH_METADATA,
+                return_properties=RESULT_PROPERTIES,
+                filters=species_filter_for(frozenset([species_filter]))
             )
         else:
             response = collection.query.near_vector(
-                near_vector=qv.tolist(),
+                near_vector=qv,
                 limit=req.top_k,
-                return_metadata=wvc.query.MetadataQuery(certainty=True, distance=True)
+                return_metadata=SEARCH_METADATA,
+                return_properties=RESULT_PROPERTIES
             )
         
-        results = []
-        for obj in response.objects:
-            results.append({
-                "id": str(obj.uuid),
-                "score": obj.metadata.certainty if obj.metadata.certainty else (1 - obj.metadata.distance) if obj.metadata.distance else 0.0,
-                "meta": { 
-                    "file": obj.properties.get("file"), 
-                    "caption": obj.properties.get("caption"), 
-                    "species": obj.properties.get("species") 
-                }
-            })
+        results = pack_results(response.objects, distance_metric_of(collection))
         # store previous_search_vector in redis for session
-        redis_set_json(r, f"{req.session_id}:previous_search_vector", qv.tolist())
+        redis_set_vec(rb, f"{req.session_id}:previous_search_vector:f16", qv)
         
         # Save search history
         save_search_history(
@@ -194,6 +299,15 @@ class FeedbackResponse(BaseModel):
     refined_vector: list
     turn_feedback_vector: list
 
+def decode_image(fp):
+    """Decode an uploaded file object to an RGB PIL image"""
+    with Image.open(fp) as image:
+        return image.convert("RGB")
+
+def encode_image_vector(model_encoder, image):
+    """Unit-norm embedding of a single PIL image"""
+    return l2norm_np(model_encoder.encode_images([image])[0])
+
 @app.post("/search-by-image", response_model=SearchResponse)
 async def search_by_image(
     session_id: str = Form(...), 
@@ -206,42 +320,33 @@ async def search_by_image(
     if client is None:
         raise HTTPException(status_code=500, detail="Weaviate client not configured")
     
-    # Get model-specific encoder and collection
-    model_encoder = get_encoder_for_model(model_key)
+    # Get model-specific encoder and collection (first use loads the model, keep it off the event loop)
+    model_encoder = await run_in_threadpool(get_encoder_for_model, model_key)
     collection_name = get_collection_name(model_key)
     
     try:
-        # Read and process uploaded image
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data)).convert("RGB")
+        # Read and process uploaded image; PIL decode, encoding and the query run in the threadpool
+        # PIL reads straight from the spooled upload file, no extra bytes copy
+        await file.seek(0)
+        image = await run_in_threadpool(decode_image, file.file)
         
         # Encode image to vector
-        qv = model_encoder.encode_images([image])[0]
-        qv = l2norm_np(qv)
+        qv = await run_in_threadpool(encode_image_vector, model_encoder, image)
         
         # Search in Weaviate
-        import weaviate.classes as wvc
-        collection = client.collections.get(collection_name)
-        response = collection.query.near_vector(
-            near_vector=qv.tolist(),
+        collection = get_collection(collection_name)
+        response = await run_in_threadpool(
+            collection.query.near_vector,
+            near_vector=qv,
             limit=top_k,
-            return_metadata=wvc.query.MetadataQuery(certainty=True, distance=True)
+            return_metadata=SEARCH_METADATA,
+            return_properties=RESULT_PROPERTIES
         )
         
-        results = []
-        for obj in response.objects:
-            results.append({
-                "id": str(obj.uuid),
-                "score": obj.metadata.certainty if obj.metadata.certainty else (1 - obj.metadata.distance) if obj.metadata.distance else 0.0,
-                "meta": { 
-                    "file": obj.properties.get("file"), 
-                    "caption": obj.properties.get("caption"), 
-                    "species": obj.properties.get("species") 
-                }
-            })
+        results = pack_results(response.objects, distance_metric_of(collection))
         
         # Store vector for feedback
-        redis_set_json(r, f"{session_id}:previous_search_vector", qv.tolist())
+        redis_set_vec(rb, f"{session_id}:previous_search_vector:f16", qv)
         
         # Save search history
         save_search_history(
@@ -258,79 +363,87 @@ async def search_by_image(
         logger.exception("Image upload search error: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/feedback", response_model=FeedbackResponse)
-def feedback(req: FeedbackRequest):
-    if client is None:
-        raise HTTPException(status_code=500, detail="Weaviate client not configured")
-
-    # Get model-specific encoder and collection
-    model_encoder = get_encoder_for_model(req.model_key)
-    collection_name = get_collection_name(req.model_key)
-
-    # Log request for debugging
-    logger.info(f"Feedback request - session: {req.session_id}, model: {req.model_key}, liked: {len(req.liked_image_ids)}, disliked: {len(req.disliked_image_ids)}, text: {bool(req.feedback_text and req.feedback_text.strip())}")
-
-    # Validate at least some feedback
-    has_text_feedback = req.feedback_text and req.feedback_text.strip()
-    if not req.liked_image_ids and not req.disliked_image_ids and not has_text_feedback:
-        raise HTTPException(status_code=400, detail="Please provide at least one feedback: liked images, disliked images, or text")
-
-    # get prev vector
-    prev = redis_get_json(r, f"{req.session_id}:previous_search_vector")
-    if prev is None:
-        raise HTTPException(status_code=400, detail="No previous search found. Please search first.")
-    prev_v = np.asarray(prev, dtype=np.float32)
-
-    # encode text feedback
-    v_text = None
-    if has_text_feedback:
-        v_text = model_encoder.encode_text([req.feedback_text])[0]
-
-    # fetch liked image vectors from Weaviate by uuid
-    v_like = None
-    liked_species = set()  # Track species of liked images
-    if req.liked_image_ids:
-        vecs = []
-        collection = client.collections.get(collection_name)
-        for uid in req.liked_image_ids:
-            if not uid:  # Skip empty/None IDs
-                continue
-            try:
-                obj = collection.query.fetch_object_by_id(uid, include_vector=True)
-                if obj and obj.vector:
-                    vecs.append(np.array(obj.vector["default"] if isinstance(obj.vector, dict) else obj.vector, dtype=np.float32))
-                    # Track species of liked images
-                    if obj.properties.get("species"):
-                        liked_species.add(obj.properties.get("species"))
-            except Exception as e:
-                logger.warning("Failed to fetch liked object %s: %s", uid, e)
-        if vecs:
-            v_like = np.mean(np.stack(vecs, axis=0), axis=0)
-
-    # fetch disliked image vectors from Weaviate by uuid
-    v_dislike = None
-    disliked_species = set()  # Track species of disliked images
-    if req.disliked_image_ids:
-        vecs = []
-        collection = client.collections.get(collection_name)
-        for uid in req.disliked_image_ids:
-            if not uid:  # Skip empty/None IDs
-                continue
-            try:
-                obj = collection.query.fetch_object_by_id(uid, include_vector=True)
-                if obj and obj.vector:
-                    vecs.append(np.array(obj.vector["default"] if isinstance(obj.vector, dict) else obj.vector, dtype=np.float32))
-                    # Track species of disliked images
-                    if obj.properties.get("species"):
-                        disliked_species.add(obj.properties.get("species"))
-            except Exception as e:
-                logger.warning("Failed to fetch disliked object %s: %s", uid, e)
-        if vecs:
-            v_dislike = np.mean(np.stack(vecs, axis=0), axis=0)
-    
-    logger.info(f"Liked species: {liked_species}, Disliked species: {disliked_species}")
+def score_of(metadata, metric="cosine"):
+    """
+    Similarity score in [0, 1] from query metadata, on the scale of cosine certainty:
+    (1 + cos) / 2. Vectors are unit length, so every metric's distance maps onto cos.
+    """
+    if metadata.certainty is not None:
+        return metadata.certainty
+    d = metadata.distance
+    if d is None:
+        return 0.0
+    if metric == "dot":
+        return (1 - d) / 2  # distance = -dot
+    if metric == "l2-squared":
+        return 1 - d / 4  # distance = 2 - 2cos
+    return 1 - d / 2  # cosine: distance = 1 - cos
+
+def pack_results(objs, metric="cosine", skip_ids=()):
+    """Response rows {id, score, meta} for query result objects, leaving out skip_ids"""
+    results = []
+    append = results.append
+    for obj in objs:
+        obj_id = str(obj.uuid)
+        if obj_id in skip_ids:
+            continue
+        p = obj.properties
+        append({
+            "id": obj_id,
+            "score": score_of(obj.metadata, metric),
+            "meta": {"file": p.get("file"), "caption": p.get("caption"), "species": p.get("species")}
+        })
+    return results
 
-    # fuse with Rocchio algorithm: Q_new = Q_old + α*relevant - β*non_relevant
+def valid_object_ids(ids):
+    """ids without empty, duplicate or non-UUID entries, in order"""
+    valid = []
+    for uid in dict.fromkeys(uid for uid in ids if uid):
+        try:
+            uuid.UUID(str(uid))
+        except ValueError:
+            logger.warning("Skipping invalid object id %r", uid)
+            continue
+        valid.append(uid)
+    return valid
+
+def fetch_vectors_by_ids(collection, ids):
+    """Fetch objects for a list of ids in a single query; returns {id: (vector, species)}"""
+    # one malformed id would fail the whole contains_any query, so drop it alone
+    ids = valid_object_ids(ids)
+    found = {}
+    if not ids:
+        return found
+    try:
+        response = collection.query.fetch_objects(
+            filters=wvc.query.Filter.by_id().contains_any(ids),
+            include_vector=True,
+            limit=len(ids),
+            return_properties=["species"]
+        )
+    except Exception as e:
+        logger.warning("Failed to fetch objects %s: %s", ids, e)
+        return found
+    for obj in response.objects:
+        if obj.vector:
+            vec = np.array(obj.vector["default"] if isinstance(obj.vector, dict) else obj.vector, dtype=np.float32)
+            found[str(obj.uuid)] = (vec, obj.properties.get("species"))
+    return found
+
+def mean_vector_by_ids(found, ids):
+    """Mean vector and species set of the given ids from a fetch_vectors_by_ids() result"""
+    hits = [found[str(uid).lower()] for uid in dict.fromkeys(ids) if uid and str(uid).lower() in found]
+    if not hits:
+        return None, set()
+    # streaming mean into one D-sized buffer, no (N, D) stack
+    acc = np.zeros(hits[0][0].shape, dtype=np.float32)
+    for vec, _ in hits:
+        acc += vec
+    acc *= 1.0 / len(hits)
+    return acc, {sp for _, sp in hits if sp}
+
+def fuse_feedback(req, prev_v, v_text, v_like, v_dislike, liked_species):
+    """Rocchio update of the session vector; returns (v_new, v_turn)."""
     v_turn = None
     if v_text is not None and v_like is not None:
         v_turn = l2norm_np(req.w_text * v_text + req.w_like * v_like)
@@ -357,8 +470,7 @@ def feedback(req: FeedbackRequest):
         if v_like is not None:
             # secondary_attrs = những gì disliked có mà liked không có
             # (màu sắc khác, pose khác, background khác...)
-            secondary_attrs = v_dislike - v_like
-            secondary_attrs = l2norm_np(secondary_attrs)
+            secondary_attrs = l2norm_np(v_dislike - v_like)
             
             # Giảm secondary attributes với gamma weight (mặc định 0.5)
             # gamma càng cao = giảm màu sắc/attributes phụ càng nhiều
@@ -376,62 +488,93 @@ def feedback(req: FeedbackRequest):
     # Ensure v_turn is set for response (even if None, set to v_new)
     if v_turn is None:
         v_turn = v_new
+    return v_new, v_turn
+
+# cleared the first time the server rejects a ContainsNone filter (older Weaviate versions)
+_contains_none_supported = True
+
+def _disable_contains_none():
+    global _contains_none_supported
+    _contains_none_supported = False
+
+@app.post("/feedback", response_model=FeedbackResponse)
+def feedback(req: FeedbackRequest):
+    if client is None:
+        raise HTTPException(status_code=500, detail="Weaviate client not configured")
+
+    # Get model-specific encoder and collection
+    model_encoder = get_encoder_for_model(req.model_key)
+    collection_name = get_collection_name(req.model_key)
+
+    # Log request for debugging
+    logger.info(f"Feedback request - session: {req.session_id}, model: {req.model_key}, liked: {len(req.liked_image_ids)}, disliked: {len(req.disliked_image_ids)}, text: {bool(req.feedback_text and req.feedback_text.strip())}")
+
+    # Validate at least some feedback
+    has_text_feedback = req.feedback_text and req.feedback_text.strip()
+    if not req.liked_image_ids and not req.disliked_image_ids and not has_text_feedback:
+        raise HTTPException(status_code=400, detail="Please provide at least one feedback: liked images, disliked images, or text")
+
+    # get prev vector
+    prev_v = redis_get_vec(rb, f"{req.session_id}:previous_search_vector:f16")
+    if prev_v is None:
+        raise HTTPException(status_code=400, detail="No previous search found. Please search first.")
+
+    # encode text feedback
+    v_text = None
+    if has_text_feedback:
+        v_text = model_encoder.encode_text([req.feedback_text])[0]
+
+    # fetch liked + disliked image vectors from Weaviate in one query, split locally
+    collection = get_collection(collection_name)
+    found = fetch_vectors_by_ids(collection, req.liked_image_ids + req.disliked_image_ids)
+    v_like, liked_species = mean_vector_by_ids(found, req.liked_image_ids)  # Track species of liked images
+    v_dislike, disliked_species = mean_vector_by_ids(found, req.disliked_image_ids)
+    
+    logger.info(f"Liked species: {liked_species}, Disliked species: {disliked_species}")
+
+    # fuse with Rocchio algorithm: Q_new = Q_old + α*relevant - β*non_relevant
+    v_new, v_turn = fuse_feedback(req, prev_v, v_text, v_like, v_dislike, liked_species)
 
     # update previous vector in redis
-    redis_set_json(r, f"{req.session_id}:previous_search_vector", v_new.tolist())
+    redis_set_vec(rb, f"{req.session_id}:previous_search_vector:f16", v_new)
     # optionally update aggregated vector / history similar to earlier design
 
     # search again in Weaviate
     try:
-        import weaviate.classes as wvc
-        collection = client.collections.get(collection_name)
-        
         # Build filter: prioritize liked species, exclude disliked images
         search_filter = None
         
         # If we have liked species, filter to only show same species
         if liked_species:
             # Filter to only show images from liked species
-            species_filters = [
-                wvc.query.Filter.by_property("species").equal(sp) 
-                for sp in liked_species
-            ]
-            if len(species_filters) == 1:
-                search_filter = species_filters[0]
-            else:
-                search_filter = wvc.query.Filter.any_of(species_filters)
+            search_filter = species_filter_for(frozenset(liked_species))
             logger.info(f"Filtering results to species: {liked_species}")
         
-        # Request more results to filter out disliked ones
-        fetch_limit = req.top_k + len(req.disliked_image_ids) * 2
-        
-        response = collection.query.near_vector(
-            near_vector=v_new.tolist(),
-            limit=fetch_limit,
-            filters=search_filter,
-            return_metadata=wvc.query.MetadataQuery(certainty=True, distance=True)
-        )
-        
-        # Filter out disliked images from results
-        disliked_set = set(req.disliked_image_ids)
-        results = []
-        for obj in response.objects:
-            obj_id = str(obj.uuid)
-            # Skip disliked images
-            if obj_id in disliked_set:
-                continue
-            results.append({
-                "id": obj_id,
-                "score": obj.metadata.certainty if obj.metadata.certainty else (1 - obj.metadata.distance) if obj.metadata.distance else 0.0,
-                "meta": { 
-                    "file": obj.properties.get("file"), 
-                    "caption": obj.properties.get("caption"), 
-                    "species": obj.properties.get("species")
-                }
-            })
-            # Stop when we have enough results
-            if len(results) >= req.top_k:
-                break
+        # Exclude disliked images server-side so exactly top_k come back;
+        # clients or servers without ContainsNone over-fetch and filter below instead
+        disliked_ids = valid_object_ids(req.disliked_image_ids)
+        def query(filters, limit):
+            return collection.query.near_vector(
+                near_vector=v_new,
+                limit=limit,
+                filters=filters,
+                return_metadata=SEARCH_METADATA,
+                return_properties=RESULT_PROPERTIES
+            )
+        response = None
+        if disliked_ids and _contains_none_supported and hasattr(wvc.query.Filter.by_id(), "contains_none"):
+            exclude = wvc.query.Filter.by_id().contains_none(disliked_ids)
+            try:
+                response = query(exclude if search_filter is None else wvc.query.Filter.all_of([search_filter, exclude]), req.top_k)
+            except weaviate.exceptions.WeaviateQueryError as e:
+                logger.warning("Server-side exclusion rejected, over-fetching instead: %s", e)
+                _disable_contains_none()
+        if response is None:
+            fetch_limit = req.top_k + len(disliked_ids) * 2 if disliked_ids else req.top_k
+            response = query(search_filter, fetch_limit)
+        
+        # Skip disliked images (no-op when excluded server-side), stop when we have enough results
+        results = pack_results(response.objects, distance_metric_of(collection), skip_ids=set(disliked_ids))[:req.top_k]
                 
         logger.info(f"Returning {len(results)} results after filtering")
         return FeedbackResponse(results=results, refined_vector=v_new.tolist(), turn_feedback_vector=v_turn.tolist())
@@ -464,22 +607,35 @@ def get_available_models():
         })
     return {"models": models, "default": "clip-base-p32"}
 
+# Last /stats answer; the frontend polls it, counts only change on indexing
+stats_cache = {"at": 0.0, "value": None}
+
+def count_collection(collection_name):
+    """Object count of one collection"""
+    return get_collection(collection_name).aggregate.over_all(total_count=True).total_count
+
 @app.get("/stats")
 def get_stats():
     """Get database statistics for all models"""
     if client is None:
         raise HTTPException(status_code=500, detail="Weaviate not configured")
     
+    if stats_cache["value"] is not None and time.time() - stats_cache["at"] < settings.STATS_TTL:
+        return stats_cache["value"]
+    
     stats = {}
     total = 0
     
-    # Get stats for each model's collection
+    # Count each model's collection concurrently (one aggregate round-trip each)
+    with ThreadPoolExecutor(max_workers=len(settings.AVAILABLE_MODELS)) as pool:
+        futures = {
+            model_key: pool.submit(count_collection, model_info["collection"])
+            for model_key, model_info in settings.AVAILABLE_MODELS.items()
+        }
     for model_key, model_info in settings.AVAILABLE_MODELS.items():
         collection_name = model_info["collection"]
         try:
-            collection = client.collections.get(collection_name)
-            response = collection.aggregate.over_all(total_count=True)
-            count = response.total_count
+            count = futures[model_key].result()
             stats[model_key] = {
                 "collection": collection_name,
                 "count": count,
@@ -494,10 +650,34 @@ def get_stats():
                 "error": str(e)
             }
     
-    return {
+    result = {
         "total_images": total,
         "models": stats
     }
+    stats_cache.update(at=time.time(), value=result)
+    return result
+
+HISTORY_MAX = 100  # Keep only last 100 searches per user
+
+def migrate_history(history_key: str):
+    """Convert a legacy JSON-string history (newest first) into a Redis list"""
+    legacy = redis_get_json(r, history_key) or []
+    pipe = r.pipeline()  # MULTI: readers never see the key deleted but not yet refilled
+    pipe.delete(history_key)
+    if legacy:
+        pipe.rpush(history_key, *[orjson.dumps(e) for e in legacy[:HISTORY_MAX]])
+    pipe.execute()
+    logger.info("Migrated search history %s to a Redis list", history_key)
+
+def with_history_list(history_key: str, queue, transaction=False):
+    """Run the commands queue(pipe) adds on a history list, migrating a legacy string key first"""
+    try:
+        return queue(r.pipeline(transaction=transaction)).execute()
+    except redis.exceptions.ResponseError as e:
+        if "WRONGTYPE" not in str(e):
+            raise
+        migrate_history(history_key)
+        return queue(r.pipeline(transaction=transaction)).execute()
 
 def save_search_history(session_id: str, user_id: str, query_text: str, query_type: str, num_results: int, top_result_id: str):
     """Save search history to Redis"""
@@ -512,11 +692,18 @@ def save_search_history(session_id: str, user_id: str, query_text: str, query_ty
             "num_results": num_results,
             "top_result_id": top_result_id
         }
-        # Add to list (keep last 100)
-        history = redis_get_json(r, history_key) or []
-        history.insert(0, entry)
-        history = history[:100]  # Keep only last 100 searches
-        redis_set_json(r, history_key, history)
+        # Add to list (keep last 100). The seeded flag is read in the same transaction: until
+        # the backfill has snapshotted the histories it counts this entry, so only count it here after
+        *_, seeded = with_history_list(
+            history_key,
+            lambda pipe: pipe.lpush(history_key, orjson.dumps(entry)).ltrim(history_key, 0, HISTORY_MAX - 1).get(ANALYTICS_SEEDED),
+            transaction=True
+        )
+        if seeded == "1":
+            record_analytics(r.pipeline(transaction=False), user_id, query_text, query_type).execute()
+        elif seeded is None:
+            # the startup backfill failed or never ran; this entry is already in its snapshot
+            seed_analytics()
         logger.info(f"Saved search history for user {user_id}")
     except Exception as e:
         logger.warning(f"Failed to save search history: {e}")
@@ -524,48 +711,85 @@ def save_search_history(session_id: str, user_id: str, query_text: str, query_ty
 @app.get("/history/{user_id}")
 def get_search_history(user_id: str, limit: int = 20):
     """Get search history for a user"""
+    if limit <= 0:
+        return {"history": []}  # lrange(0, -1) would return the whole list
     try:
         history_key = f"history:{user_id}"
-        history = redis_get_json(r, history_key) or []
-        return {"history": history[:limit]}
+        raw, = with_history_list(history_key, lambda pipe: pipe.lrange(history_key, 0, limit - 1))
+        return {"history": [orjson.loads(e) for e in raw]}
     except Exception as e:
         logger.exception("Failed to get history: %s", e)
         return {"history": [], "error": str(e)}
 
+ANALYTICS_QUERY_TYPES = "analytics:query_types"
+ANALYTICS_TOP_QUERIES = "analytics:top_queries"
+ANALYTICS_USERS = "analytics:users"
+ANALYTICS_SEEDED = "analytics:seeded"
+
+def record_analytics(pipe, user_id: str, query_text: str, query_type: str):
+    """Queue the analytics counter updates for one search on a Redis pipeline"""
+    pipe.hincrby(ANALYTICS_QUERY_TYPES, query_type, 1)
+    pipe.sadd(ANALYTICS_USERS, user_id)
+    if query_text and not query_text.startswith("[Image:"):
+        pipe.zincrby(ANALYTICS_TOP_QUERIES, 1, query_text)
+    return pipe
+
+def seed_analytics():
+    """
+    One-time backfill of the analytics counters from saved histories. Searches only
+    count themselves once analytics:seeded is "1", which the backfill sets in the same
+    transaction that snapshots the histories, so no search is counted twice.
+    """
+    # claim the backfill so only one worker runs it; the claim expires, so a worker
+    # killed before the snapshot doesn't block the retry on the next startup
+    if not r.set(ANALYTICS_SEEDED, "seeding", nx=True, ex=600):
+        return
+    try:
+        keys, histories = _snapshot_histories()
+    except Exception:
+        r.delete(ANALYTICS_SEEDED)
+        raise
+    pipe = r.pipeline(transaction=False)
+    for key, raw in zip(keys, histories):
+        user_id = key.split(":", 1)[1]
+        for entry in map(orjson.loads, raw):
+            record_analytics(pipe, entry.get("user_id", user_id), entry.get("query_text", ""), entry.get("query_type", "text"))
+    pipe.execute()
+    logger.info("Seeded analytics counters from existing search history")
+
+def _snapshot_histories():
+    """(keys, entries) of every history list, read atomically with marking analytics seeded"""
+    keys = list(r.scan_iter(match="history:*", count=500))
+    types = r.pipeline(transaction=False)
+    for key in keys:
+        types.type(key)
+    for key, key_type in zip(keys, types.execute()):
+        if key_type == "string":
+            migrate_history(key)
+    pipe = r.pipeline(transaction=True)
+    for key in keys:
+        pipe.lrange(key, 0, -1)
+    pipe.set(ANALYTICS_SEEDED, 1)
+    return keys, pipe.execute()[:-1]
+
 @app.get("/analytics")
 def get_analytics():
     """Get analytics across all users"""
     try:
-        # Get all history keys
-        all_keys = []
-        cursor = 0
-        while True:
-            cursor, keys = r.scan(cursor, match="history:*", count=100)
-            all_keys.extend(keys)
-            if cursor == 0:
-                break
-        
-        total_searches = 0
+        pipe = r.pipeline(transaction=False)
+        pipe.hgetall(ANALYTICS_QUERY_TYPES)
+        pipe.zrevrange(ANALYTICS_TOP_QUERIES, 0, 9, withscores=True)
+        pipe.scard(ANALYTICS_USERS)
+        counts, top, total_users = pipe.execute()
+
         query_types = {"text": 0, "image": 0}
-        top_queries = {}
-        
-        for key in all_keys:
-            history = redis_get_json(r, key) or []
-            total_searches += len(history)
-            for entry in history:
-                query_types[entry.get("query_type", "text")] += 1
-                query_text = entry.get("query_text", "")
-                if query_text and not query_text.startswith("[Image:"):
-                    top_queries[query_text] = top_queries.get(query_text, 0) + 1
-        
-        # Sort top queries
-        sorted_queries = sorted(top_queries.items(), key=lambda x: x[1], reverse=True)[:10]
+        query_types.update({k: int(v) for k, v in counts.items()})
         
         return {
-            "total_searches": total_searches,
-            "total_users": len(all_keys),
+            "total_searches": sum(query_types.values()),
+            "total_users": total_users,
             "query_types": query_types,
-            "top_queries": [{"query": q, "count": c} for q, c in sorted_queries]
+            "top_queries": [{"query": q, "count": int(c)} for q, c in top]
         }
     except Exception as e:
         logger.exception("Analytics error: %s", e)
@@ -628,7 +852,6 @@ async def upload_image_to_db(
     user_id: str = Form("anonymous")
 ):
     """Upload and index a new image to clip-base-p32 model only"""
-    import time
     start_time = time.time()
     
     if client is None:
@@ -636,13 +859,12 @@ async def upload_image_to_db(
     
     try:
         # Read and validate image
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data)).convert("RGB")
+        # PIL reads straight from the spooled upload file, no extra bytes copy
+        await file.seek(0)
+        image = await run_in_threadpool(decode_image, file.file)
         read_time = time.time() - start_time
         
         # Generate unique filename
-        import uuid
-        from datetime import datetime
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         file_ext = os.path.splitext(file.filename)[1] or '.jpg'
         unique_filename = f"user_upload_{timestamp}_{uuid.uuid4().hex[:8]}{file_ext}"
@@ -652,18 +874,16 @@ async def upload_image_to_db(
         provided_species = species
         
         # Index to clip-base-p32 only
-        import weaviate.classes as wvc
         model_key = "clip-base-p32"
         model_info = settings.AVAILABLE_MODELS[model_key]
         
         # Get encoder for this model
         encode_start = time.time()
-        model_encoder = get_encoder_for_model(model_key)
+        model_encoder = await run_in_threadpool(get_encoder_for_model, model_key)
         collection_name = model_info["collection"]
         
         # Encode image
-        vector = model_encoder.encode_images([image])[0]
-        vector = l2norm_np(vector)
+        vector = await run_in_threadpool(encode_image_vector, model_encoder, image)
         encode_time = time.time() - encode_start
         
         # Auto-classify if species not provided
@@ -672,7 +892,7 @@ async def upload_image_to_db(
         top_matches = []
         
         if not species:
-            detected_species, classification_score, top_matches = auto_classify_image(vector, model_encoder)
+            detected_species, classification_score, top_matches = await run_in_threadpool(auto_classify_image, vector, model_encoder)
             species = detected_species
             auto_classified = True
             logger.info(f"Auto-detected species: {species} (confidence: {classification_score:.3f})")
@@ -684,7 +904,7 @@ async def upload_image_to_db(
         upload_dir = f"data/full/{storage_folder}"
         os.makedirs(upload_dir, exist_ok=True)
         image_path = os.path.join(upload_dir, unique_filename)
-        image.save(image_path)
+        await run_in_threadpool(image.save, image_path)
         save_time = time.time() - start_time - read_time - encode_time
         
         relative_path = f"full/{storage_folder}/{unique_filename}"
@@ -699,25 +919,27 @@ async def upload_image_to_db(
                 "file": relative_path,
                 "caption": caption,
                 "species": species,
-                "extra": json.dumps({
+                "extra": orjson.dumps({
                     "uploaded_by": user_id, 
                     "uploaded_at": timestamp,
                     "auto_classified": auto_classified,
                     "classification_score": classification_score
-                }),
+                }).decode(),
                 "model_key": model_key
             },
-            "vector": vector.tolist()
+            "vector": vector
         }
         
         # Insert to Weaviate
         db_start = time.time()
-        collection = client.collections.get(collection_name)
-        uuid_result = collection.data.insert(
+        collection = get_collection(collection_name)
+        uuid_result = await run_in_threadpool(
+            collection.data.insert,
             properties=obj_data["properties"],
             vector=obj_data["vector"]
         )
         db_time = time.time() - db_start
+        stats_cache["value"] = None  # counts changed
         
         total_time = time.time() - start_time
         
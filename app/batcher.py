@@ -0,0 +1,55 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from app.utils import logger
+
+class MicroBatcher:
+    """
+    Coalesces single-item calls from concurrent request threads into batched calls.
+
+    submit(item) returns a Future. A background thread takes the first queued item,
+    keeps collecting for up to max_wait_ms or until max_batch items, then runs
+    fn(items) once and resolves each Future with its row of the result.
+    """
+
+    def __init__(self, fn, max_batch=32, max_wait_ms=10, name="batcher"):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        fut = Future()
+        self._queue.put((item, fut))
+        return fut
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                out = self.fn(items)
+            except Exception as e:
+                logger.warning("Batched call of %d items failed: %s", len(items), e)
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, fut), row in zip(batch, out):
+                fut.set_result(row)
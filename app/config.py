@@ -9,10 +9,18 @@ class Settings:
 
     WEAVIATE_URL = os.getenv("WEAVIATE_URL", "")
     WEAVIATE_API_KEY = os.getenv("WEAVIATE_API_KEY", "")
+    # distance for new collections; vectors are L2-normalized at ingest so dot == cosine
+    VECTOR_DISTANCE = os.getenv("VECTOR_DISTANCE", "dot")
+    # vector compression for new collections: sq (int8), bq (1-bit), pq, rq, none; empty = server default
+    VECTOR_QUANTIZER = os.getenv("VECTOR_QUANTIZER", "")
 
     VECTOR_DIM = int(os.getenv("VECTOR_DIM", "512"))
     ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "hf_clip")
+    # exported graphs for ENCODER_BACKEND=onnx (image tower served by onnxruntime)
+    ONNX_DIR = os.getenv("ONNX_DIR", "models/onnx")
     CLIP_MODEL = os.getenv("CLIP_MODEL", "openai/clip-vit-base-patch32")
+    # torch.compile the model forwards (pays a one-off compile on first call)
+    TORCH_COMPILE = os.getenv("TORCH_COMPILE", "false").lower() == "true"
     
     # Multi-model support
     AVAILABLE_MODELS = {
@@ -37,5 +45,29 @@ class Settings:
     INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", 64))
     ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", 16))
     WEAVIATE_BATCH_SIZE = int(os.getenv("WEAVIATE_BATCH_SIZE", 64))
+    WEAVIATE_CONCURRENT_REQUESTS = int(os.getenv("WEAVIATE_CONCURRENT_REQUESTS", 4))
+    VQA_BATCH_SIZE = int(os.getenv("VQA_BATCH_SIZE", 32))
+    # VQA answers are a few words; each extra token is one more decoder step
+    VQA_MAX_NEW_TOKENS = int(os.getenv("VQA_MAX_NEW_TOKENS", 8))
+    INDEX_NUM_WORKERS = int(os.getenv("INDEX_NUM_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+    # reuse CLIP vectors / VQA answers from Redis for images indexed before (keyed by content hash)
+    INDEX_CACHE = os.getenv("INDEX_CACHE", "true").lower() == "true"
+    # seconds a cached VQA answer set lives (default 7 days)
+    INDEX_META_TTL = int(os.getenv("INDEX_META_TTL", 7 * 24 * 3600))
+    # seconds a cached CLIP vector lives (default 30 days)
+    INDEX_EMB_TTL = int(os.getenv("INDEX_EMB_TTL", 30 * 24 * 3600))
+    # object batches queued for the background Weaviate writer before encoding blocks
+    INDEX_WRITE_QUEUE = int(os.getenv("INDEX_WRITE_QUEUE", 4))
+    # /search text encodes from concurrent requests are coalesced into one forward
+    TEXT_BATCH_MAX = int(os.getenv("TEXT_BATCH_MAX", 32))
+    TEXT_BATCH_WAIT_MS = float(os.getenv("TEXT_BATCH_WAIT_MS", 10))
+    # seconds a cached query text vector lives (default 1 day)
+    TEXT_VECTOR_TTL = int(os.getenv("TEXT_VECTOR_TTL", 24 * 3600))
+    # seconds /stats reuses its last collection counts
+    STATS_TTL = float(os.getenv("STATS_TTL", 5))
+
+    def dim_of(self, model_key):
+        """Vector dimension of a model entry; VECTOR_DIM for unknown keys"""
+        return self.AVAILABLE_MODELS.get(model_key, {}).get("vector_dim", self.VECTOR_DIM)
 
 settings = Settings()
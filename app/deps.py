@@ -2,14 +2,19 @@
 
 Provides:
  - get_redis(): return redis.Redis instance
- - redis_set_json(r, key, obj): set JSON-serialised value
+ - redis_set_json(r, key, obj): set JSON-serialised value (orjson bytes)
  - redis_get_json(r, key): get and parse JSON value
+ - get_redis_binary(): redis.Redis instance returning raw bytes
+ - redis_set_vec(rb, key, vec, ex=None) / redis_get_vec(rb, key): float16 vector bytes
+ - redis_mset_bytes(rb, mapping): pipelined write of many byte values
 """
 import redis
-import json
+import orjson
+import numpy as np
 from app.config import settings
 
 _redis_client = None
+_redis_binary_client = None
 
 def get_redis():
     global _redis_client
@@ -24,14 +29,49 @@ def get_redis():
 
 def redis_set_json(r, key, obj):
     """Store Python object as JSON string in Redis (string key)."""
-    r.set(key, json.dumps(obj))
+    r.set(key, orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS))
 
 def redis_get_json(r, key):
     v = r.get(key)
     if not v:
         return None
     try:
-        return json.loads(v)
+        return orjson.loads(v)
     except Exception:
         # if stored as plain string, return raw
         return v
+
+def get_redis_binary():
+    """Redis client without response decoding, for binary values such as vectors."""
+    global _redis_binary_client
+    if _redis_binary_client is None:
+        _redis_binary_client = redis.Redis(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            db=settings.REDIS_DB,
+            decode_responses=False
+        )
+    return _redis_binary_client
+
+def redis_set_vec(rb, key, vec, ex=None):
+    """Store a vector as raw float16 bytes (half the size of float32, no JSON); ex is a TTL in seconds."""
+    rb.set(key, np.asarray(vec).astype(np.float16).tobytes(), ex=ex)
+
+def redis_get_vec(rb, key):
+    """Read a vector stored by redis_set_vec as float32, or None if missing."""
+    v = rb.get(key)
+    if not v:
+        return None
+    return np.frombuffer(v, dtype=np.float16).astype(np.float32)
+
+def redis_mset_bytes(rb, mapping, ex=None):
+    """Write many raw byte values in one round-trip; with ex, each key gets that TTL (seconds)."""
+    if not mapping:
+        return
+    pipe = rb.pipeline(transaction=False)
+    if ex is None:
+        pipe.mset(mapping)
+    else:
+        for key, value in mapping.items():
+            pipe.set(key, value, ex=ex)
+    pipe.execute()
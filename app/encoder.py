@@ -1,6 +1,8 @@
 from app.config import settings
-from app.utils import l2norm_np, logger
+from app.utils import logger, l2norm_np
+from PIL import Image
 import numpy as np
+import threading
 import torch
 
 def load_hf_clip(model_name=None, device=None):
@@ -9,9 +11,64 @@ def load_hf_clip(model_name=None, device=None):
     device = device or ("cuda" if torch.cuda.is_available() else "cpu")
     logger.info(f"Loading CLIP model: {model_name}")
     model = CLIPModel.from_pretrained(model_name).to(device)
+    if device == "cuda":
+        # fp16 weights: half the memory traffic, tensor-core matmuls
+        model = model.half()
     processor = CLIPProcessor.from_pretrained(model_name)
     return model, processor, device
 
+# fixed padded lengths for text batches: stable shapes for compiled graphs, little wasted attention
+TEXT_BUCKETS = (16, 32, 64, 77)
+
+def bucket_length(n, buckets=TEXT_BUCKETS):
+    """Smallest bucket that holds n tokens, or None if n is longer than every bucket."""
+    return next((b for b in buckets if n <= b), None)
+
+def build_clip_transform(processor):
+    """
+    torchvision equivalent of the CLIP image processor (resize shortest edge, center crop,
+    rescale, normalize), built once from its config; None if the config is not the usual shape.
+    """
+    ip = getattr(processor, "image_processor", None)
+    size = getattr(ip, "size", None) or {}
+    crop = getattr(ip, "crop_size", None) or {}
+    if "shortest_edge" not in size or "height" not in crop:
+        return None
+    if not (ip.do_resize and ip.do_center_crop and ip.do_rescale and ip.do_normalize) or abs(ip.rescale_factor - 1 / 255) > 1e-9:
+        return None
+    from torchvision import transforms as T
+    from torchvision.transforms import functional as TF
+    height, width = crop["height"], crop["width"]
+    transform = T.Compose([
+        T.Resize(size["shortest_edge"], interpolation=T.InterpolationMode(Image.Resampling(ip.resample).name.lower())),
+        # floor the offsets like the processor; T.CenterCrop rounds them and shifts odd margins by a pixel
+        T.Lambda(lambda img: TF.crop(img, (img.height - height) // 2, (img.width - width) // 2, height, width)),
+        T.ToTensor(),
+        T.Normalize(ip.image_mean, ip.image_std),
+    ])
+    # parity check on an odd-sized image, so a processor/torchvision mismatch falls back to the processor
+    probe = Image.fromarray(np.random.default_rng(0).integers(0, 256, (517, 333, 3), dtype=np.uint8))
+    diff = (transform(probe) - processor(images=[probe], return_tensors="pt")["pixel_values"][0]).abs().max().item()
+    if diff > 1e-4:
+        logger.warning("torchvision transform differs from the CLIP processor by %.3g; using the processor", diff)
+        return None
+    return transform
+
+def autocast_fp16(device):
+    """fp16 autocast context on CUDA; disabled (plain fp32) on CPU."""
+    on_cuda = str(device).startswith("cuda")
+    return torch.autocast(device_type="cuda" if on_cuda else "cpu", dtype=torch.float16, enabled=on_cuda)
+
+def unit_rows(features):
+    """
+    L2-normalize model features on their device in fp32, then copy the result to a float32 numpy array.
+    From CUDA the rows cross to the host as fp16 (half the bytes; the fp16 model's output precision).
+    """
+    out = torch.nn.functional.normalize(features.float(), dim=-1)
+    if out.is_cuda:
+        out = out.half()
+    return out.cpu().numpy().astype(np.float32, copy=False)
+
 def load_st_model(name: str):
     from sentence_transformers import SentenceTransformer
     model = SentenceTransformer(name)
@@ -28,28 +85,105 @@ class Encoder:
             self.model = load_st_model(self.model_name if "clip" in self.model_name.lower() else "clip-ViT-B-32")
         else:
             self.model, self.processor, self.device = load_hf_clip(self.model_name, self.device)
+        if self.backend not in ("sentence_transformers", "onnx") and settings.TORCH_COMPILE:
+            self._compile()
+        self.transform = None
+        if self.backend != "sentence_transformers":
+            try:
+                self.transform = build_clip_transform(self.processor)
+            except ImportError:
+                logger.warning("torchvision not available; using the HF image processor")
+        self.ort_images = self.ort_text = None
+        if self.backend == "onnx":
+            # both towers run from exported ONNX graphs; the torch model is kept for export and config
+            from app.encoder_ort import OrtImageEncoder, OrtTextEncoder
+            self.ort_images = OrtImageEncoder(self.model, self.model_name)
+            self.ort_text = OrtTextEncoder(self.model, self.model_name)
+        # per-thread pinned staging buffers for pixel uploads, keyed by batch shape
+        self._pinned = threading.local()
+
+    def _compile(self):
+        """torch.compile the CLIP towers and pay the compile cost once with a dummy batch."""
+        # the processor always yields image_size x image_size pixels, so the vision tower
+        # sees fixed shapes and can use CUDA graphs; text lengths vary, so no graphs there
+        self.model.vision_model = torch.compile(self.model.vision_model, mode="reduce-overhead", fullgraph=False)
+        self.model.text_model = torch.compile(self.model.text_model, fullgraph=False)
+        size = self.model.config.vision_config.image_size
+        try:
+            with torch.inference_mode(), autocast_fp16(self.device):
+                self.model.get_image_features(
+                    pixel_values=torch.zeros(1, 3, size, size, dtype=self.model.dtype, device=self.device))
+                self.model.get_text_features(**self.processor(text=["warmup"], return_tensors="pt").to(self.device))
+            logger.info("Compiled CLIP towers for %s", self.model_name)
+        except Exception as e:
+            logger.warning("CLIP compile warmup failed: %s", e)
+
+    def _pixels(self, pil_images):
+        """CPU float32 pixel_values for a list of PIL images."""
+        if self.transform is None:
+            return self.processor(images=pil_images, return_tensors="pt")["pixel_values"]
+        return torch.stack([self.transform(im if im.mode == "RGB" else im.convert("RGB")) for im in pil_images])
+
+    def _pixels_to_device(self, pixel_values):
+        """Move pixel_values to the model device/dtype; on CUDA via a reused pinned buffer and an async copy."""
+        if self.device != "cuda":
+            return pixel_values.to(self.device, self.model.dtype)
+        bufs = self._pinned.__dict__.setdefault("bufs", {})
+        buf = bufs.get(pixel_values.shape)
+        if buf is None:
+            buf = bufs[pixel_values.shape] = torch.empty(pixel_values.shape, dtype=self.model.dtype, pin_memory=True)
+        # the previous upload from this buffer finished: encode_images syncs on .cpu() before returning
+        buf.copy_(pixel_values)
+        return buf.to(self.device, non_blocking=True)
 
     def encode_text(self, texts):
+        # run each distinct string through the model once, then scatter rows back
+        unique = list(dict.fromkeys(texts))
+        if len(unique) < len(texts):
+            pos = {t: i for i, t in enumerate(unique)}
+            return self._encode_text(unique)[[pos[t] for t in texts]]
+        return self._encode_text(texts)
+
+    def _encode_text(self, texts):
         if self.backend == "sentence_transformers":
-            emb = self.model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
-            return l2norm_np(np.array(emb))
+            emb = self.model.encode(texts, convert_to_numpy=True, show_progress_bar=False, normalize_embeddings=True)
+            return emb.astype(np.float32, copy=False)
         else:
-            inputs = self.processor(text=texts, return_tensors="pt", padding=True).to(self.device)
-            with torch.no_grad():
-                out = self.model.get_text_features(**inputs)
-            emb = out.cpu().numpy()
-            return l2norm_np(np.array(emb))
+            # group texts by padded length bucket, encode each bucket, scatter back to input order
+            max_len = self.model.config.text_config.max_position_embeddings
+            lengths = [len(ids) for ids in self.processor.tokenizer(list(texts), truncation=True, max_length=max_len)["input_ids"]]
+            buckets = {}
+            for i, n in enumerate(lengths):
+                buckets.setdefault(min(bucket_length(n) or max_len, max_len), []).append(i)
+            out = None
+            for length, idx in buckets.items():
+                batch = [texts[i] for i in idx]
+                if self.ort_text is not None:
+                    inputs = self.processor.tokenizer(batch, return_tensors="np", padding="max_length",
+                                                      max_length=length, truncation=True)
+                    feats = l2norm_np(self.ort_text(inputs["input_ids"], inputs["attention_mask"]))
+                else:
+                    inputs = self.processor(text=batch, return_tensors="pt", padding="max_length",
+                                            max_length=length, truncation=True).to(self.device)
+                    with torch.inference_mode(), autocast_fp16(self.device):
+                        feats = unit_rows(self.model.get_text_features(**inputs))
+                if out is None:
+                    out = np.empty((len(texts), feats.shape[1]), dtype=np.float32)
+                out[idx] = feats
+            return out
 
     def encode_images(self, pil_images):
         # pil_images: list of PIL.Image
         if self.backend == "sentence_transformers":
             try:
-                emb = self.model.encode(pil_images, convert_to_numpy=True, show_progress_bar=False)
-                return l2norm_np(np.array(emb))
+                emb = self.model.encode(pil_images, convert_to_numpy=True, show_progress_bar=False, normalize_embeddings=True)
+                return emb.astype(np.float32, copy=False)
             except Exception as e:
                 logger.warning("ST encode images failed: %s; falling back to HF CLIP", e)
-        inputs = self.processor(images=pil_images, return_tensors="pt", padding=True).to(self.device)
-        with torch.no_grad():
-            out = self.model.get_image_features(**inputs)
-        emb = out.cpu().numpy()
-        return l2norm_np(np.array(emb))
+        pixel_values = self._pixels(pil_images)
+        if self.ort_images is not None:
+            return l2norm_np(self.ort_images(pixel_values.numpy()))
+        pixel_values = self._pixels_to_device(pixel_values)
+        with torch.inference_mode(), autocast_fp16(self.device):
+            out = self.model.get_image_features(pixel_values=pixel_values)
+        return unit_rows(out)
@@ -0,0 +1,99 @@
+"""ONNX Runtime backend for the CLIP towers (ENCODER_BACKEND=onnx).
+
+Each tower (vision or text model + projection) is exported once per model/dtype
+to settings.ONNX_DIR and then served by an onnxruntime session, preferring
+TensorRT, then CUDA, then CPU. onnxruntime is optional and only imported when
+this backend is selected.
+"""
+import inspect
+import os
+import numpy as np
+import torch
+from app.config import settings
+from app.utils import logger
+
+PREFERRED_PROVIDERS = ["TensorrtExecutionProvider", "CUDAExecutionProvider", "CPUExecutionProvider"]
+
+class _ImageFeatures(torch.nn.Module):
+    """CLIPModel.get_image_features as a plain module for export"""
+    def __init__(self, clip):
+        super().__init__()
+        self.clip = clip
+
+    def forward(self, pixel_values):
+        return self.clip.get_image_features(pixel_values=pixel_values)
+
+class _TextFeatures(torch.nn.Module):
+    """CLIPModel.get_text_features as a plain module for export"""
+    def __init__(self, clip):
+        super().__init__()
+        self.clip = clip
+
+    def forward(self, input_ids, attention_mask):
+        return self.clip.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+def _export(module, inputs, input_names, dynamic_axes, path):
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False  # TorchScript exporter: no onnxscript dependency
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with torch.inference_mode():
+        torch.onnx.export(
+            module.eval(), inputs, path,
+            input_names=input_names, output_names=["embeds"],
+            dynamic_axes=dict(dynamic_axes, embeds={0: "B"}),
+            opset_version=14, **kwargs
+        )
+    logger.info("Exported %s to %s", type(module).__name__, path)
+
+def export_image_onnx(model, path, image_size=224):
+    """Export the CLIP image tower with a dynamic batch axis"""
+    param = next(model.parameters())
+    dummy = torch.zeros(1, 3, image_size, image_size, dtype=param.dtype, device=param.device)
+    _export(_ImageFeatures(model), (dummy,), ["pixel_values"], {"pixel_values": {0: "B"}}, path)
+
+def export_text_onnx(model, path):
+    """Export the CLIP text tower with dynamic batch and sequence axes"""
+    device = next(model.parameters()).device
+    ids = torch.ones(2, 8, dtype=torch.long, device=device)
+    mask = torch.ones(2, 8, dtype=torch.long, device=device)
+    axes = {"input_ids": {0: "B", 1: "T"}, "attention_mask": {0: "B", 1: "T"}}
+    _export(_TextFeatures(model), (ids, mask), ["input_ids", "attention_mask"], axes, path)
+
+def _session(path):
+    import onnxruntime as ort
+    available = ort.get_available_providers()
+    providers = [p for p in PREFERRED_PROVIDERS if p in available]
+    session = ort.InferenceSession(path, providers=providers)
+    logger.info("ONNX session %s on %s", path, session.get_providers()[0])
+    return session
+
+def _onnx_path(model, model_name, tower):
+    dtype = np.float16 if next(model.parameters()).dtype == torch.float16 else np.float32
+    name = model_name.strip("/").replace("/", "__")
+    return os.path.join(settings.ONNX_DIR, f"{name}.{tower}.{np.dtype(dtype).name}.onnx"), dtype
+
+class OrtImageEncoder:
+    """CLIP image features via onnxruntime; takes processor pixel_values as numpy"""
+    def __init__(self, model, model_name):
+        path, self.input_dtype = _onnx_path(model, model_name, "image")
+        if not os.path.exists(path):
+            export_image_onnx(model, path, model.config.vision_config.image_size)
+        self.session = _session(path)
+
+    def __call__(self, pixel_values):
+        feed = {"pixel_values": np.ascontiguousarray(pixel_values, dtype=self.input_dtype)}
+        return self.session.run(None, feed)[0].astype(np.float32, copy=False)
+
+class OrtTextEncoder:
+    """CLIP text features via onnxruntime; takes tokenizer input_ids / attention_mask as numpy"""
+    def __init__(self, model, model_name):
+        path, _ = _onnx_path(model, model_name, "text")
+        if not os.path.exists(path):
+            export_text_onnx(model, path)
+        self.session = _session(path)
+
+    def __call__(self, input_ids, attention_mask):
+        feed = {"input_ids": np.ascontiguousarray(input_ids, dtype=np.int64),
+                "attention_mask": np.ascontiguousarray(attention_mask, dtype=np.int64)}
+        return self.session.run(None, feed)[0].astype(np.float32, copy=False)
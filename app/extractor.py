@@ -1,23 +1,48 @@
 from PIL import Image
 from typing import List, Dict
-from app.encoder import Encoder
+from app.config import settings
+from app.encoder import Encoder, autocast_fp16, bucket_length
 from app.utils import logger
 from transformers import BlipProcessor, BlipForQuestionAnswering
 import torch
 import json
+import threading
+import numpy as np
+
+VQA_MODEL_ID = "Salesforce/blip-vqa-base"
 
 class FeatureExtractor:
     def __init__(self, model_name=None):
         self.encoder = Encoder(model_name=model_name)
-        # load VQA model (BLIP base for VQA tasks)
-        try:
-            self.vqa_processor = BlipProcessor.from_pretrained("Salesforce/blip-vqa-base")
-            self.vqa_model = BlipForQuestionAnswering.from_pretrained("Salesforce/blip-vqa-base").to(self.encoder.device)
-            logger.info("Loaded VQA model on %s", self.encoder.device)
-        except Exception as e:
-            logger.warning("VQA load failed: %s — disabling VQA", e)
-            self.vqa_processor = None
-            self.vqa_model = None
+        # BLIP is loaded on first VQA use, so CLIP-only callers never pay for it
+        self.vqa_processor = None
+        self.vqa_model = None
+        self._vqa_loaded = False
+        self._vqa_lock = threading.Lock()
+
+    def _load_vqa(self):
+        """Load the VQA model (BLIP base for VQA tasks) once; on failure VQA stays disabled."""
+        if self._vqa_loaded:
+            return
+        with self._vqa_lock:
+            if self._vqa_loaded:
+                return
+            try:
+                self.vqa_processor = BlipProcessor.from_pretrained(VQA_MODEL_ID)
+                vqa_model = BlipForQuestionAnswering.from_pretrained(VQA_MODEL_ID).to(self.encoder.device)
+                if self.encoder.device == "cuda":
+                    # fp16 weights halve memory traffic on the ViT + text decoder
+                    vqa_model = vqa_model.half()
+                if settings.TORCH_COMPILE:
+                    # BLIP's processor always yields 384x384 pixels, so the ViT sees fixed shapes
+                    vqa_model.vision_model = torch.compile(vqa_model.vision_model, mode="reduce-overhead", fullgraph=False)
+                self.vqa_model = vqa_model
+                logger.info("Loaded VQA model on %s", self.encoder.device)
+            except Exception as e:
+                logger.warning("VQA load failed: %s — disabling VQA", e)
+                self.vqa_processor = None
+                self.vqa_model = None
+            self._vqa_loaded = True
 
     def load_image(self, path):
         try:
@@ -27,39 +52,109 @@ class FeatureExtractor:
             logger.error("Open image fail %s: %s", path, e)
             return None
 
-    def vqa_answer(self, image, question, max_new_tokens=24):
+    def _vqa_pixels(self, images):
+        """BLIP pixel_values (CPU) for each image, preprocessed once; None if VQA is off or preprocessing fails."""
+        self._load_vqa()
         if self.vqa_model is None:
-            return ""
+            return None
+        try:
+            return self.vqa_processor.image_processor(images=list(images), return_tensors="pt")["pixel_values"]
+        except Exception as e:
+            logger.warning("VQA preprocessing failed: %s", e)
+            return None
+
+    def _vqa_generate(self, pixel_values, questions, max_new_tokens=None):
+        """Run one BLIP generate() over aligned rows of pixel_values and questions."""
+        self._load_vqa()
+        if self.vqa_model is None or pixel_values is None or not questions:
+            return [""] * len(questions)
         try:
-            inputs = self.vqa_processor(images=image, text=question, return_tensors="pt").to(self.encoder.device)
-            with torch.no_grad():
-                out = self.vqa_model.generate(**inputs, max_new_tokens=max_new_tokens, num_beams=1)
-            ans = self.vqa_processor.decode(out[0], skip_special_tokens=True).strip().lower()
-            return ans
+            # pad questions to a fixed bucket length rather than the longest in the batch
+            longest = max(len(ids) for ids in self.vqa_processor.tokenizer(list(questions))["input_ids"])
+            bucket = bucket_length(longest)
+            padding = {"padding": "max_length", "max_length": bucket} if bucket else {"padding": True}
+            text = self.vqa_processor.tokenizer(list(questions), return_tensors="pt", **padding).to(self.encoder.device)
+            pixel_values = pixel_values.to(self.encoder.device, self.vqa_model.dtype)
+            with torch.inference_mode(), autocast_fp16(self.encoder.device):
+                out = self.vqa_model.generate(pixel_values=pixel_values, input_ids=text["input_ids"],
+                                              attention_mask=text["attention_mask"],
+                                              max_new_tokens=max_new_tokens or settings.VQA_MAX_NEW_TOKENS,
+                                              num_beams=1, do_sample=False, use_cache=True)
+            answers = self.vqa_processor.batch_decode(out, skip_special_tokens=True)
+            return [a.strip().lower() for a in answers]
+        except torch.cuda.OutOfMemoryError:
+            if len(questions) <= 1:
+                raise
+            # batch too big for this GPU: retry as two halves
+            torch.cuda.empty_cache()
+            logger.warning("VQA OOM on batch of %d, splitting", len(questions))
+            half = len(questions) // 2
+            return (self._vqa_generate(pixel_values[:half], questions[:half], max_new_tokens)
+                    + self._vqa_generate(pixel_values[half:], questions[half:], max_new_tokens))
         except Exception as e:
             logger.warning("VQA failed: %s", e)
-            return ""
+            return [""] * len(questions)
+
+    def vqa_answer_batch(self, image, questions, max_new_tokens=None):
+        """Answer all questions about one image with a single generate() call."""
+        pixels = self._vqa_pixels([image])
+        if pixels is not None:
+            pixels = pixels.expand(len(questions), -1, -1, -1)
+        return self._vqa_generate(pixels, questions, max_new_tokens)
 
     def extract_metadata(self, pil_image, questions):
         """
         Extract metadata using VQA.
         questions can be a dict {key: question} or list of questions
         """
-        meta = {}
-        if isinstance(questions, dict):
-            for key, q in questions.items():
-                ans = self.vqa_answer(pil_image, q)
-                meta[q] = ans  # Use question as key for consistency
-        else:
-            for q in questions:
-                ans = self.vqa_answer(pil_image, q)
-                meta[q] = ans
-        return meta
+        # identical questions under different keys are asked once
+        qs = list(dict.fromkeys(questions.values() if isinstance(questions, dict) else questions))
+        answers = self.vqa_answer_batch(pil_image, qs)
+        return dict(zip(qs, answers))  # Use question as key for consistency
+
+    def _question_order(self, qs):
+        """Indices of qs sorted by token length, so batches pad to similar lengths."""
+        self._load_vqa()
+        if self.vqa_processor is None:
+            return list(range(len(qs)))
+        lengths = [len(ids) for ids in self.vqa_processor.tokenizer(list(qs))["input_ids"]]
+        return sorted(range(len(qs)), key=lambda i: lengths[i])
+
+    def extract_metadata_batch(self, pil_images, questions):
+        """
+        Extract VQA metadata for several images at once.
+        Every (image, question) pair is flattened into BLIP batches of
+        settings.VQA_BATCH_SIZE; returns one {question: answer} dict per image.
+        Pairs are laid out question-major in token-length order, so each
+        batch mostly repeats one question and pads little.
+        """
+        qs = list(dict.fromkeys(questions.values() if isinstance(questions, dict) else questions))
+        pairs = [(qi, ii) for qi in self._question_order(qs) for ii in range(len(pil_images))]
+        # each image is resized/normalized once; batches gather its row per question
+        pixels = self._vqa_pixels(pil_images)
+        answers = []
+        step = settings.VQA_BATCH_SIZE
+        for i in range(0, len(pairs), step):
+            chunk = pairs[i:i + step]
+            rows = pixels[[ii for _, ii in chunk]] if pixels is not None else None
+            answers.extend(self._vqa_generate(rows, [qs[qi] for qi, _ in chunk]))
+        results = [{} for _ in pil_images]
+        for (qi, ii), answer in zip(pairs, answers):
+            results[ii][qs[qi]] = answer
+        # keep the caller's question order in each dict
+        return [{q: r[q] for q in qs} for r in results]
 
     def encode_image(self, pil_images: List):
-        return self.encoder.encode_images(pil_images)
+        try:
+            return self.encoder.encode_images(pil_images)
+        except torch.cuda.OutOfMemoryError:
+            if len(pil_images) <= 1:
+                raise
+            # batch too big for this GPU: encode as two halves
+            torch.cuda.empty_cache()
+            logger.warning("CLIP OOM on batch of %d, splitting", len(pil_images))
+            half = len(pil_images) // 2
+            return np.concatenate([self.encode_image(pil_images[:half]), self.encode_image(pil_images[half:])])
 
     def encode_texts(self, texts: List[str]):
         return self.encoder.encode_text(texts)
-
-extractor = FeatureExtractor()
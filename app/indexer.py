@@ -1,13 +1,20 @@
-import argparse, json
-from pathlib import Path
-from app.extractor import FeatureExtractor
+import argparse
+import orjson
+from app.extractor import FeatureExtractor, VQA_MODEL_ID
+from app.deps import get_redis_binary, redis_mset_bytes
 from app.weaviate_client import get_weaviate_client, create_schema_if_not_exists, batch_add_objects, get_collection_name
 from app.config import settings
-from app.utils import logger
+from app.utils import logger, random_uuids
 from tqdm import tqdm
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
 import numpy as np
-import uuid
+import hashlib
+import io
 import os
+import queue
+import threading
+import sys
 
 # Optimized metadata questions - focus on visual features only
 # Biological knowledge (animal_class, body_coverage, locomotion, diet, habitat) 
@@ -222,11 +229,100 @@ SPECIES_KNOWLEDGE = {
     }
 }
 
+# merged into every image's metadata: build the per-species dicts once, with interned keys
+SPECIES_TEMPLATE = {sp: {sys.intern(k): v for k, v in kb.items()} for sp, kb in SPECIES_KNOWLEDGE.items()}
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+
 def gather_images(root):
-    p = Path(root)
-    files = [x for x in p.rglob("*") if x.suffix.lower() in [".jpg", ".jpeg", ".png", ".webp"]]
+    """Image file paths (str) under root; iterative os.scandir walk, no per-file stat or Path objects"""
+    files = []
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTS:
+                    files.append(entry.path)
     return files
 
+# largest model input side (BLIP VQA 384, CLIP 224); decoding more pixels than this is wasted
+DECODE_MIN_SIDE = 384
+
+class ImgDataset(Dataset):
+    """Image files decoded to (path, RGB PIL image, sha1 of the file bytes); unreadable files yield (path, None, None)."""
+    def __init__(self, files):
+        self.files = files
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, idx):
+        path = self.files[idx]
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            img = Image.open(io.BytesIO(data))
+            # JPEG: decode at a reduced DCT scale that still keeps both sides >= the BLIP input size
+            img.draft("RGB", (DECODE_MIN_SIDE, DECODE_MIN_SIDE))
+            return path, img.convert("RGB"), hashlib.sha1(data).hexdigest()
+        except Exception as e:
+            logger.error("Open image fail %s: %s", path, e)
+            return path, None, None
+
+class EmbeddingCache:
+    """
+    Redis cache of CLIP vectors (float16 bytes) and raw VQA answers (JSON),
+    keyed by image content hash. Keys carry the model ids and the question
+    set, so switching either one misses instead of returning stale results.
+    """
+    def __init__(self, rb, model_name, questions):
+        qs = list(questions.values()) if isinstance(questions, dict) else list(questions)
+        qhash = hashlib.sha1(orjson.dumps(sorted(qs))).hexdigest()[:12]
+        self.rb = rb
+        self.emb_prefix = f"emb:{model_name}:"
+        self.meta_prefix = f"meta:{VQA_MODEL_ID}:{qhash}:"
+
+    def get(self, digests):
+        """[(vector or None, answers or None)] for each digest, in one MGET"""
+        raw = self.rb.mget([self.emb_prefix + d for d in digests] + [self.meta_prefix + d for d in digests])
+        n = len(digests)
+        return [
+            (np.frombuffer(v, dtype=np.float16).astype(np.float32) if v else None, orjson.loads(m) if m else None)
+            for v, m in zip(raw[:n], raw[n:])
+        ]
+
+    def put(self, digests, vecs, metas):
+        """
+        Cache vectors, and answers only when every question got one: a failed or
+        unloaded VQA model yields empty strings, which must not outlive that run.
+        Vectors expire after settings.INDEX_EMB_TTL, answers after settings.INDEX_META_TTL.
+        """
+        emb, meta_map = {}, {}
+        for d, vec, meta in zip(digests, vecs, metas):
+            emb[self.emb_prefix + d] = np.asarray(vec).astype(np.float16).tobytes()
+            if meta and all(meta.values()):
+                meta_map[self.meta_prefix + d] = orjson.dumps(meta)
+        redis_mset_bytes(self.rb, emb, ex=settings.INDEX_EMB_TTL)
+        redis_mset_bytes(self.rb, meta_map, ex=settings.INDEX_META_TTL)
+
+def open_embedding_cache(model_name, questions):
+    """EmbeddingCache on the configured Redis, or None when disabled/unreachable"""
+    if not settings.INDEX_CACHE:
+        return None
+    try:
+        rb = get_redis_binary()
+        rb.ping()
+    except Exception as e:
+        logger.warning("Embedding cache disabled, Redis unavailable: %s", e)
+        return None
+    return EmbeddingCache(rb, model_name, questions)
+
+def _collate_list(items):
+    # keep PIL images as a plain list; the CLIP/BLIP processors do the tensor conversion
+    return items
+
 def infer_species(image_path):
     species_name = os.path.basename(os.path.dirname(str(image_path)))
     return species_name
@@ -235,15 +331,85 @@ def enrich_metadata_with_knowledge(species, visual_metadata):
     """
     Enrich visual metadata with species-specific biological knowledge
     """
-    if species in SPECIES_KNOWLEDGE:
-        knowledge = SPECIES_KNOWLEDGE[species]
-        # Merge knowledge into metadata
-        enriched = visual_metadata.copy()
-        for key, value in knowledge.items():
-            if key not in enriched or not enriched[key]:
-                enriched[key] = value
-        return enriched
-    return visual_metadata
+    tmpl = SPECIES_TEMPLATE.get(species)
+    if not tmpl:
+        return visual_metadata
+    # knowledge fills keys that are missing or empty; non-empty visual answers win
+    return {**visual_metadata, **tmpl, **{k: v for k, v in visual_metadata.items() if v}}
+
+def build_objects(extractor, pending, questions, model_key=None, cache=None):
+    """
+    Encode a mini-batch of (path, pil, species, sha1) tuples with one CLIP forward
+    and batched VQA, returning Weaviate objects in the same order.
+    With a cache, only images whose hash misses go through the models.
+    """
+    pils = [t[1] for t in pending]
+    digests = [t[3] for t in pending]
+    found = cache.get(digests) if cache else [(None, None)] * len(pending)
+    miss = [i for i, (vec, meta) in enumerate(found) if vec is None or meta is None]
+    if miss:
+        miss_pils = [pils[i] for i in miss]
+        miss_vecs = extractor.encode_image(miss_pils)
+        miss_metas = extractor.extract_metadata_batch(miss_pils, questions)
+        if cache:
+            cache.put([digests[i] for i in miss], miss_vecs, miss_metas)
+        for i, vec, meta in zip(miss, miss_vecs, miss_metas):
+            found[i] = (vec, meta)
+    uuids = random_uuids(len(pending))
+
+    objects = []
+    for (p, _, folder_species, _), (vec, meta_answers), obj_uuid in zip(pending, found, uuids):
+        # Enrich with species-specific biological knowledge
+        meta_answers = enrich_metadata_with_knowledge(folder_species, meta_answers)
+        props = {
+            "file": str(p),
+            "species": folder_species,
+            "extra": orjson.dumps(meta_answers).decode(),
+            "model_key": model_key or "custom"
+        }
+        # float32 ndarray row as-is; the Weaviate client serializes it, no per-float boxing here
+        objects.append({"uuid": obj_uuid, "properties": props, "vector": vec})
+    return objects
+
+class WeaviateWriter:
+    """
+    Background thread draining object batches into batch_add_objects, so network
+    inserts overlap decoding and encoding. The bounded queue applies backpressure;
+    a failed insert is re-raised on the next put() or on close().
+    """
+    def __init__(self, client, collection_name, depth=None, batch_size=None):
+        self.client = client
+        self.collection_name = collection_name
+        self.batch_size = batch_size or settings.WEAVIATE_BATCH_SIZE
+        self.error = None
+        self._queue = queue.Queue(maxsize=depth or settings.INDEX_WRITE_QUEUE)
+        self._thread = threading.Thread(target=self._run, name="weaviate-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, objects):
+        if self.error:
+            raise self.error
+        self._queue.put(objects)
+
+    def close(self):
+        """Flush queued batches and stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+        if self.error:
+            raise self.error
+
+    def _run(self):
+        while True:
+            objects = self._queue.get()
+            if objects is None:
+                return
+            if self.error:
+                continue  # drain without inserting once a batch has failed
+            try:
+                batch_add_objects(self.client, objects, batch_size=self.batch_size, collection_name=self.collection_name)
+            except Exception as e:
+                logger.error("Weaviate insert of %d objects failed: %s", len(objects), e)
+                self.error = e
 
 def index_folder(root_folder, weaviate_mode=True, dry_run=True, limit=None, detailed_metadata=False, model_name=None, model_key=None):
 
@@ -280,46 +446,41 @@ def index_folder(root_folder, weaviate_mode=True, dry_run=True, limit=None, deta
 
     if weaviate_mode:
         client = get_weaviate_client()
-        create_schema_if_not_exists(collection_name)
+        create_schema_if_not_exists(collection_name, client)
     else:
         client = None
 
+    cache = open_embedding_cache(extractor.encoder.model_name, questions)
+
+    # Decode in DataLoader workers so disk I/O + JPEG decode overlap the GPU forward
+    workers = settings.INDEX_NUM_WORKERS
+    loader = DataLoader(
+        ImgDataset(files),
+        batch_size=settings.ENCODE_BATCH_SIZE,
+        num_workers=workers,
+        prefetch_factor=4 if workers else None,
+        collate_fn=_collate_list
+    )
+
+    writer = WeaviateWriter(client, collection_name) if not dry_run and weaviate_mode else None
     batch = []
-    for p in tqdm(files, desc="Indexing"):
-        pil = extractor.load_image(str(p))
-        if pil is None:
-            continue
-        
+    for items in tqdm(loader, desc="Indexing"):
         # Get species from folder name first
-        folder_species = infer_species(p)
-        
-        # Extract visual metadata from image
-        meta_answers = extractor.extract_metadata(pil, questions)
-        
-        # Enrich with species-specific biological knowledge
-        meta_answers = enrich_metadata_with_knowledge(folder_species, meta_answers)
-        
-        props = {
-            "file": str(p),
-            "species": folder_species,
-            "extra": json.dumps(meta_answers),
-            "model_key": model_key or "custom"
-        }
-        vec = extractor.encode_image([pil])[0]
-        vec = vec.tolist()
-        # use seq id or a stable id
-        
-        batch.append({"properties": props, "vector": vec})
+        pending = [(p, pil, infer_species(p), digest) for p, pil, digest in items if pil is not None]
+        if not pending:
+            continue
 
+        batch.extend(build_objects(extractor, pending, questions, model_key, cache))
 
         if len(batch) >= settings.WEAVIATE_BATCH_SIZE:
-            if not dry_run and weaviate_mode:
-                batch_add_objects(client, batch, batch_size=settings.WEAVIATE_BATCH_SIZE, collection_name=collection_name)
+            if writer:
+                writer.put(batch)
             batch = []
 
-    if batch:
-        if not dry_run and weaviate_mode:
-            batch_add_objects(client, batch, batch_size=settings.WEAVIATE_BATCH_SIZE, collection_name=collection_name)
+    if batch and writer:
+        writer.put(batch)
+    if writer:
+        writer.close()
     
     if client:
         client.close()
@@ -3,7 +3,7 @@ app/redis_utils.py
 Helpers để lấy Redis client và lưu/đọc JSON.
 """
 import redis
-import json
+import orjson
 from app.config import settings
 
 _redis_client = None
@@ -24,7 +24,7 @@ def redis_set_json(r, key, obj):
     Lưu Python object dưới dạng JSON string tại key.
     r: redis.Redis instance
     """
-    r.set(key, json.dumps(obj))
+    r.set(key, orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS))
 
 def redis_get_json(r, key):
     """
@@ -34,6 +34,6 @@ def redis_get_json(r, key):
     if not v:
         return None
     try:
-        return json.loads(v)
+        return orjson.loads(v)
     except Exception:
         return v
@@ -1,29 +1,96 @@
 import numpy as np
 import logging
+import os
 import time
+import math
+import uuid
+import hashlib
 from functools import wraps
 
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional; l2norm_np falls back to numpy
+    njit = None
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 logger = logging.getLogger("image-retrieval")
 
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _l2norm_inplace(x):
+        # four independent partial sums break the add dependency chain so the loop vectorizes
+        n = x.shape[0]
+        s0 = s1 = s2 = s3 = 0.0
+        end = n - n % 4
+        for i in range(0, end, 4):
+            s0 += x[i] * x[i]
+            s1 += x[i + 1] * x[i + 1]
+            s2 += x[i + 2] * x[i + 2]
+            s3 += x[i + 3] * x[i + 3]
+        for i in range(end, n):
+            s0 += x[i] * x[i]
+        inv = 1.0 / (math.sqrt(s0 + s1 + s2 + s3) + 1e-12)
+        for i in range(n):
+            x[i] *= inv
+        return x
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _l2norm_rows_inplace(x):
+        # rows spread over numba's thread pool; no temporaries for the norms
+        for i in prange(x.shape[0]):
+            s = 0.0
+            for j in range(x.shape[1]):
+                s += x[i, j] * x[i, j]
+            inv = 1.0 / (math.sqrt(s) + 1e-12)
+            for j in range(x.shape[1]):
+                x[i, j] *= inv
+        return x
+else:
+    _l2norm_inplace = None
+    _l2norm_rows_inplace = None
+
+def l2norm_rows_inplace(x: np.ndarray):
+    """
+    Scale each row of a C-contiguous (B, D) float32 array to unit length, in place.
+    Uses numba's parallel thread pool, which must not be entered from several threads at
+    once (the workqueue layer aborts the process): for offline scripts only, not the API.
+    """
+    if _l2norm_rows_inplace is not None:
+        return _l2norm_rows_inplace(x)
+    x /= np.sqrt(np.einsum('ij,ij->i', x, x))[:, None] + 1e-12
+    return x
+
 def l2norm_np(v: np.ndarray):
-    v = v.astype("float32")
-    n = np.linalg.norm(v) + 1e-12
+    # normalizes along the last axis, so a (B, D) batch gets unit rows
+    # one contiguous float32 copy; the in-place kernel must not touch the caller's array,
+    # which may be read-only (np.frombuffer) or shared
+    v = np.array(v, dtype=np.float32, order="C")
+    if v.ndim == 1 and _l2norm_inplace is not None:
+        return _l2norm_inplace(v)
+    n = np.linalg.norm(v, axis=-1, keepdims=True) + 1e-12
     return v / n
 
+def random_uuids(n):
+    """n random version-4 UUID strings drawn from a single os.urandom() call."""
+    raw = os.urandom(16 * n)
+    return [str(uuid.UUID(bytes=raw[i * 16:(i + 1) * 16], version=4)) for i in range(n)]
+
+def stable_uuids(names):
+    """One UUID string per name from a 16-byte blake2b digest; the same name always maps to the same UUID."""
+    return [str(uuid.UUID(bytes=hashlib.blake2b(name.encode(), digest_size=16).digest())) for name in names]
+
 def retry(exceptions, tries=3, delay=1.0, backoff=2.0):
+    # backoff schedule computed once per decorated function, not per call
+    delays = tuple(delay * backoff ** i for i in range(tries - 1))
     def decorator(f):
         @wraps(f)
         def wrapped(*args, **kwargs):
-            mtries, mdelay = tries, delay
-            while mtries > 1:
+            for i, d in enumerate(delays):
                 try:
                     return f(*args, **kwargs)
                 except exceptions as e:
-                    logger.warning("Exception: %s — retry in %.1fs (%d tries left)", e, mdelay, mtries-1)
-                    time.sleep(mdelay)
-                    mtries -= 1
-                    mdelay *= backoff
+                    logger.warning("Exception: %s — retry in %.1fs (%d tries left)", e, d, tries - 1 - i)
+                    time.sleep(d)
             return f(*args, **kwargs)
         return wrapped
     return decorator
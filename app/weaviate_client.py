@@ -1,16 +1,32 @@
 import weaviate
 import weaviate.classes as wvc
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from app.config import settings
-from app.utils import logger, retry
+from app.utils import logger, retry, random_uuids
 
 CLASS_NAME = "AnimalImage"  # Legacy default
 
+@lru_cache(maxsize=32)
 def get_collection_name(model_key=None):
     """Get collection name for a specific model"""
     if model_key and model_key in settings.AVAILABLE_MODELS:
         return settings.AVAILABLE_MODELS[model_key]["collection"]
     return CLASS_NAME
 
+def _additional_config():
+    """gRPC keepalive pings so a long-lived client's channel survives idle periods (needs a client with GrpcConfig)"""
+    grpc_config = getattr(wvc.init, "GrpcConfig", None)
+    if grpc_config is None:
+        return None
+    return wvc.init.AdditionalConfig(grpc_config=grpc_config(channel_options=[
+        ("grpc.keepalive_time_ms", 30000),
+        ("grpc.keepalive_timeout_ms", 10000),
+        ("grpc.keepalive_permit_without_calls", 1),
+    ]))
+
 def get_weaviate_client():
     url = settings.WEAVIATE_URL
     if not url:
@@ -18,28 +34,55 @@ def get_weaviate_client():
     if settings.WEAVIATE_API_KEY:
         client = weaviate.connect_to_weaviate_cloud(
             cluster_url=url,
-            auth_credentials=weaviate.auth.AuthApiKey(settings.WEAVIATE_API_KEY)
+            auth_credentials=weaviate.auth.AuthApiKey(settings.WEAVIATE_API_KEY),
+            additional_config=_additional_config()
         )
     else:
         client = weaviate.connect_to_custom(
             http_host=url.replace("https://", "").replace("http://", ""),
-            http_secure=url.startswith("https://")
+            http_secure=url.startswith("https://"),
+            additional_config=_additional_config()
         )
     return client
 
-def create_schema_if_not_exists(collection_name=None):
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+def get_shared_client():
+    """Process-wide client, connected on first use and closed at interpreter exit; callers must not close it."""
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = get_weaviate_client()
+                atexit.register(_shared_client.close)
+    return _shared_client
+
+def create_schema_if_not_exists(collection_name=None, client=None, quantizer=None):
+    """
+    Create the collection if missing; uses the given client, or a temporary one that is closed afterwards.
+    quantizer names a Configure.VectorIndex.Quantizer factory (sq, bq, pq, rq, none), default settings.VECTOR_QUANTIZER.
+    """
     collection_name = collection_name or CLASS_NAME
-    client = get_weaviate_client()
+    quantizer = settings.VECTOR_QUANTIZER if quantizer is None else quantizer
+    own_client = client is None
+    if own_client:
+        client = get_weaviate_client()
     try:
         # Check if collection exists
         if client.collections.exists(collection_name):
             logger.info("Weaviate collection exists: %s", collection_name)
         else:
             # Create collection with properties
-            from weaviate.classes.config import Configure, Property, DataType
+            from weaviate.classes.config import Configure, Property, DataType, VectorDistances
             client.collections.create(
                 name=collection_name,
                 vectorizer_config=Configure.Vectorizer.none(),
+                vector_index_config=Configure.VectorIndex.hnsw(
+                    distance_metric=VectorDistances(settings.VECTOR_DISTANCE),
+                    # compressed vectors: less memory and bandwidth per HNSW distance
+                    quantizer=getattr(Configure.VectorIndex.Quantizer, quantizer)() if quantizer else None
+                ),
                 properties=[
                     Property(name="file", data_type=DataType.TEXT),
                     Property(name="caption", data_type=DataType.TEXT),
@@ -50,19 +93,46 @@ def create_schema_if_not_exists(collection_name=None):
             )
             logger.info("Weaviate collection created: %s", collection_name)
     finally:
-        client.close()
+        if own_client:
+            client.close()
+
+@retry(Exception, tries=3, delay=1.0, backoff=2.0)
+def _add_shard(client, shard, collection_name, batch_size):
+    # a fresh collection handle per shard keeps batch state private to the worker thread
+    collection = client.collections.get(collection_name)
+    with collection.batch.fixed_size(batch_size=batch_size, concurrent_requests=1) as batch:
+        for obj in shard:
+            batch.add_object(properties=obj["properties"], vector=obj["vector"], uuid=obj["uuid"])
+    failed = collection.batch.failed_objects
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(shard)} objects failed: {failed[0].message}")
 
-@retry(Exception, tries=3, delay=1.0)
 def batch_add_objects(client, objects, batch_size=64, collection_name=None):
     collection_name = collection_name or CLASS_NAME
-    collection = client.collections.get(collection_name)
-    with collection.batch.dynamic() as batch:
-        for obj in objects:
-            properties = obj["properties"]
-            vector = obj["vector"]
-            uuid = obj.get("uuid", None)
-            if uuid:
-                batch.add_object(properties=properties, vector=vector, uuid=uuid)
-            else:
-                batch.add_object(properties=properties, vector=vector)
+    # explicit ids make a retried shard overwrite instead of duplicating objects
+    missing = [obj for obj in objects if not obj.get("uuid")]
+    for obj, uid in zip(missing, random_uuids(len(missing))):
+        obj["uuid"] = uid
+    shards = [objects[i:i + batch_size] for i in range(0, len(objects), batch_size)]
+    with ThreadPoolExecutor(max_workers=settings.WEAVIATE_CONCURRENT_REQUESTS) as pool:
+        # list() re-raises the first shard that still fails after its retries
+        list(pool.map(lambda shard: _add_shard(client, shard, collection_name, batch_size), shards))
     logger.info("Batched %d objects to weaviate collection %s", len(objects), collection_name)
+
+def bulk_ingest(client, objects, collection_name=None, batch_size=200, concurrent_requests=8):
+    """
+    Stream objects (any iterable, e.g. a generator fed by an encoder) through one fixed_size
+    batch context: a single gRPC batcher keeps concurrent_requests batches in flight while
+    the producer keeps running. Returns the number of objects added; raises if any failed.
+    """
+    collection = client.collections.get(collection_name or CLASS_NAME)
+    count = 0
+    with collection.batch.fixed_size(batch_size=batch_size, concurrent_requests=concurrent_requests) as batch:
+        for obj in objects:
+            batch.add_object(properties=obj["properties"], vector=obj["vector"], uuid=obj.get("uuid"))
+            count += 1
+    failed = collection.batch.failed_objects
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {count} objects failed: {failed[0].message}")
+    logger.info("Ingested %d objects into weaviate collection %s", count, collection_name or CLASS_NAME)
+    return count
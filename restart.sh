@@ -10,7 +10,11 @@ sleep 2
 # Start new process
 cd /root/XLA/Image-Retrieval-XlaProject
 source .venv39/bin/activate
-nohup uvicorn app.api:app --host 0.0.0.0 --port 8000 > /var/log/xla-api.log 2>&1 &
+# uvloop/httptools ship with uvicorn[standard]. Each worker loads its own encoders
+# (session state lives in Redis), so keep 1 worker per GPU unless serving on CPU.
+API_WORKERS=${API_WORKERS:-1}
+nohup uvicorn app.api:app --host 0.0.0.0 --port 8000 \
+    --loop uvloop --http httptools --workers "$API_WORKERS" > /var/log/xla-api.log 2>&1 &
 
 sleep 3
 
@@ -1,11 +1,34 @@
 import numpy as np, faiss, os
 VEC_PATH = "data/vectors.npy"
 IDX_PATH = os.getenv("FAISS_INDEX_PATH", "indices/faiss.index")
+# IVF-PQ (trained, compressed) instead of HNSW; worth it past ~1M vectors
+USE_IVF = os.getenv("USE_IVF", "false").lower() == "true"
 os.makedirs(os.path.dirname(IDX_PATH), exist_ok=True)
-X = np.load(VEC_PATH).astype("float32")
+# copy-on-write mmap: pages load on demand and normalize_L2 can write without touching the file;
+# only a non-float32 file is converted (one copy)
+X = np.load(VEC_PATH, mmap_mode="c")
+if X.dtype != np.float32:
+    X = X.astype("float32")
 print("Vectors shape:", X.shape)
 faiss.normalize_L2(X)
-index = faiss.IndexFlatIP(X.shape[1])
-index.add(X)
+N, D = X.shape
+# 8-bit PQ trains 256 centroids per sub-quantizer, so it needs at least that many vectors
+PQ_BITS = 8
+if USE_IVF and N < 1 << PQ_BITS:
+    print(f"Only {N} vectors, fewer than the {1 << PQ_BITS} IVF-PQ needs for training; building HNSW instead")
+    USE_IVF = False
+if USE_IVF:
+    nlist = int(4 * np.sqrt(N))
+    quantizer = faiss.IndexFlatIP(D)
+    index = faiss.IndexIVFPQ(quantizer, D, nlist, D // 4, PQ_BITS, faiss.METRIC_INNER_PRODUCT)
+    index.train(X)
+    index.add(X)
+    index.nprobe = min(nlist, 16)
+else:
+    # graph search: sub-linear queries instead of a brute-force scan; efSearch is saved with the index
+    index = faiss.IndexHNSWFlat(D, 32, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = 200
+    index.add(X)
+    index.hnsw.efSearch = 64
 faiss.write_index(index, IDX_PATH)
 print("Built FAISS index at", IDX_PATH, "ntotal=", index.ntotal)
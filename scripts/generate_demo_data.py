@@ -1,4 +1,4 @@
-import os, json, numpy as np
+import os, orjson, numpy as np
 os.makedirs("data", exist_ok=True)
 N = 200
 D = int(os.getenv("VECTOR_DIM", "512"))
@@ -7,14 +7,14 @@ X = rng.standard_normal((N, D)).astype("float32")
 np.save("data/vectors.npy", X)
 ids = np.arange(N, dtype=np.int32)
 np.save("data/ids.npy", ids)
-meta = {}
 species = ["cat","dog","bird","horse","tiger","lion"]
-for i in range(N):
-    meta[str(i)] = {
-        "file": f"images/{species[i % len(species)]}_{i:03d}.jpg",
-        "caption": f"{species[i % len(species)].capitalize()} sample {i}",
-        "species": species[i % len(species)]
-    }
-with open("data/id2meta.json", "w", encoding="utf-8") as f:
-    json.dump(meta, f, ensure_ascii=False, indent=2)
+# build all N file names / captions with array string ops instead of per-row f-strings
+sp = np.array(species)[ids % len(species)]
+num = np.char.mod("%03d", ids)
+files = np.char.add(np.char.add(np.char.add("images/", sp), "_"), np.char.add(num, ".jpg")).tolist()
+captions = np.char.add(np.char.capitalize(sp), np.char.mod(" sample %d", ids)).tolist()
+sp = sp.tolist()
+meta = {str(i): {"file": files[i], "caption": captions[i], "species": sp[i]} for i in range(N)}
+with open("data/id2meta.json", "wb") as f:
+    f.write(orjson.dumps(meta, option=orjson.OPT_INDENT_2))
 print("Demo data created.")
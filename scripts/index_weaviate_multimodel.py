@@ -12,8 +12,12 @@ Usage:
 
 import os
 import sys
-import json
+import orjson
 import argparse
+import gc
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from PIL import Image
 import numpy as np
@@ -24,59 +28,153 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.config import settings
 from app.encoder import Encoder
-from app.weaviate_client import get_weaviate_client, create_schema_if_not_exists, batch_add_objects
-from app.utils import logger, l2norm_np
+from app.weaviate_client import get_shared_client, create_schema_if_not_exists, bulk_ingest
+from app.utils import logger, stable_uuids, l2norm_rows_inplace
 from app.indexer import SPECIES_KNOWLEDGE, enrich_metadata_with_knowledge
 
 # Data directory
 DATA_DIR = Path("data/full")
 
-def get_all_images(data_dir: Path):
-    """Get all image files from data directory"""
-    images = []
+def get_all_images(data_dir):
+    """Yield an info dict per image file in data_dir/<species>/ (os.scandir: no per-entry stat or Path objects)"""
     extensions = {'.jpg', '.jpeg', '.png', '.webp', '.gif'}
     
-    for species_dir in data_dir.iterdir():
-        if species_dir.is_dir():
+    with os.scandir(data_dir) as species_dirs:
+        for species_dir in species_dirs:
+            if not species_dir.is_dir():
+                continue
             species = species_dir.name
-            for img_file in species_dir.iterdir():
-                if img_file.suffix.lower() in extensions:
-                    images.append({
-                        'path': img_file,
-                        'species': species,
-                        'relative_path': f"full/{species}/{img_file.name}"
-                    })
-    
-    return images
+            with os.scandir(species_dir.path) as entries:
+                for entry in entries:
+                    if os.path.splitext(entry.name)[1].lower() in extensions:
+                        yield {
+                            'path': entry.path,
+                            'species': species,
+                            'relative_path': f"full/{species}/{entry.name}"
+                        }
 
-def encode_images_batch(encoder, image_paths, batch_size=16):
-    """Encode images in batches"""
-    vectors = []
-    
-    for i in tqdm(range(0, len(image_paths), batch_size), desc="Encoding images"):
-        batch_paths = image_paths[i:i+batch_size]
-        batch_images = []
-        
-        for path in batch_paths:
-            try:
-                img = Image.open(path).convert('RGB')
-                batch_images.append(img)
-            except Exception as e:
-                logger.warning(f"Failed to load image {path}: {e}")
-                # Use a blank image as placeholder
-                batch_images.append(Image.new('RGB', (224, 224), color='gray'))
+# Pillow releases the GIL while decoding, so threads decode images in parallel
+_decode_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+
+# Batches read and decoded ahead of the one being encoded, so disk stalls hide behind the GPU
+PREFETCH_BATCHES = 2
+
+# Shortest side kept when decoding once for several models; the predefined CLIP models all
+# take 224px input, so their processors' own resize of these images is a no-op
+SHARED_DECODE_SIDE = 224
+
+def _load_one(path, min_side=None):
+    try:
+        img = Image.open(path).convert('RGB')
+        short = min(img.size)
+        if min_side and short > min_side:
+            # same shortest-edge bicubic resize (and rounding) as the CLIP image processor
+            w, h = img.size
+            size = (min_side, int(min_side * h / w)) if w <= h else (int(min_side * w / h), min_side)
+            img = img.resize(size, Image.BICUBIC)
+        return img
+    except Exception as e:
+        logger.warning(f"Failed to load image {path}: {e}")
+        # Use a blank image as placeholder
+        return Image.new('RGB', (224, 224), color='gray')
+
+def _submit_batch(paths):
+    return [_decode_pool.submit(_load_one, p) for p in paths]
+
+def decode_all(image_paths, min_side=SHARED_DECODE_SIDE):
+    """Decode every image once (downscaled to min_side) so several models can reuse them"""
+    return list(tqdm(_decode_pool.map(lambda p: _load_one(p, min_side), image_paths),
+                     total=len(image_paths), desc="Decoding images"))
+
+def _iter_image_batches(items, batch_size, prefetch=PREFETCH_BATCHES):
+    """(start, PIL batch) pairs; paths are read and decoded on the pool, prefetch batches ahead"""
+    if items and isinstance(items[0], Image.Image):
+        for i in range(0, len(items), batch_size):
+            yield i, items[i:i + batch_size]
+        return
+    starts = range(0, len(items), batch_size)
+    pending = deque(_submit_batch(items[i:i + batch_size]) for i in starts[:prefetch])
+    for n, i in enumerate(starts):
+        batch_images = [f.result() for f in pending.popleft()]
+        # keep the next `prefetch` batches in flight while the encoder works on this one
+        if n + prefetch < len(starts):
+            j = starts[n + prefetch]
+            pending.append(_submit_batch(items[j:j + batch_size]))
+        yield i, batch_images
+
+def iter_encoded_batches(encoder, items, batch_size=16):
+    """Yield (start, (B, D) unit vectors) per batch; items are image paths or already decoded PIL images"""
+    batches = _iter_image_batches(items, batch_size)
+    for i, batch_images in tqdm(batches, total=-(-len(items) // batch_size), desc="Encoding images"):
         
         # Encode batch
-        batch_vectors = encoder.encode_images(batch_images)
+        batch_vectors = np.ascontiguousarray(encoder.encode_images(batch_images), dtype=np.float32)
+        batch_images.clear()  # drop this batch's decoded images before the next one arrives
         
-        # Normalize
-        for vec in batch_vectors:
-            vectors.append(l2norm_np(vec))
+        # Normalize the whole (B, D) batch in place (numba row-parallel kernel when available)
+        l2norm_rows_inplace(batch_vectors)
+        yield i, batch_vectors
+
+def encode_images_batch(encoder, image_paths, batch_size=16):
+    """Encode images in batches"""
+    vectors = [v for _, v in iter_encoded_batches(encoder, image_paths, batch_size)]
+    return np.concatenate(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+
+@lru_cache(maxsize=None)
+def species_props(species):
+    """(caption, extra JSON) for a species; identical for all of its images, so built once"""
+    # Enrich with species knowledge
+    extra_data = enrich_metadata_with_knowledge(species, {})
+    
+    # Create meaningful caption from species knowledge
+    knowledge = SPECIES_KNOWLEDGE.get(species, {})
+    species_name = species.replace('_', ' ')
+    distinctive = knowledge.get('distinctive_features', '')
+    caption = f"A {species_name}"
+    if distinctive:
+        caption += f" with {distinctive.split(',')[0]}"  # First feature
     
-    return vectors
+    return caption, orjson.dumps(extra_data).decode()
+
+def make_uuids(files, model_key):
+    """Deterministic object UUIDs keyed on (model_key, file), so re-indexing overwrites instead of duplicating"""
+    return stable_uuids(f"{model_key}|{f}" for f in files)
+
+def build_object(img, vector, model_key, obj_uuid=None):
+    """Weaviate object for one image, with caption and extra from species knowledge"""
+    species = img['species']
+    caption, extra = species_props(species)
+    return {
+        "uuid": obj_uuid,
+        "properties": {
+            "file": img['relative_path'],
+            "caption": caption,
+            "species": species,
+            "extra": extra,
+            "model_key": model_key
+        },
+        # float32 row as-is; the Weaviate client serializes it for gRPC
+        "vector": vector
+    }
+
+def release_encoder(encoder):
+    """Move the encoder's weights off the GPU now, whoever still holds a reference to it"""
+    model = getattr(encoder, "model", None)
+    if model is not None and hasattr(model, "to"):
+        model.to("cpu")
+
+def release_gpu_cache():
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+        torch.cuda.ipc_collect()
 
-def index_model(model_key: str, images: list, batch_size: int = 64):
-    """Index images for a specific model"""
+def index_model(model_key: str, images: list, batch_size: int = 64, decoded: list = None, client=None, verify: bool = False):
+    """
+    Index images for a specific model; decoded optionally holds the images already decoded, in order.
+    client defaults to the process-wide shared Weaviate client, which is left open.
+    verify re-counts the collection on the server after the upload.
+    """
     if model_key not in settings.AVAILABLE_MODELS:
         logger.error(f"Unknown model: {model_key}")
         return False
@@ -92,84 +190,63 @@ def index_model(model_key: str, images: list, batch_size: int = 64):
     logger.info(f"Total images: {len(images)}")
     logger.info(f"=" * 60)
     
-    # Create encoder
-    logger.info("Loading encoder...")
-    encoder = Encoder(model_name=model_id)
-    
+    # Connect to Weaviate (one shared client for all models)
+    client = client or get_shared_client()
+
     # Create collection if not exists
     logger.info("Creating Weaviate collection if not exists...")
-    create_schema_if_not_exists(collection_name)
-    
-    # Encode all images
-    logger.info("Encoding images...")
-    image_paths = [img['path'] for img in images]
-    vectors = encode_images_batch(encoder, image_paths, batch_size=16)
-    
-    # Connect to Weaviate
-    client = get_weaviate_client()
+    create_schema_if_not_exists(collection_name, client)
+
+    # Check current count before spending any time on encoding
+    collection = client.collections.get(collection_name)
+    current_count = collection.aggregate.over_all(total_count=True).total_count
+    logger.info(f"Current objects in collection: {current_count}")
+
+    if current_count > 0:
+        response = input(f"Collection already has {current_count} objects. Delete and re-index? (y/n): ")
+        if response.lower() == 'y':
+            logger.info("Deleting existing objects...")
+            client.collections.delete(collection_name)
+            create_schema_if_not_exists(collection_name, client)
+            current_count = 0
+        else:
+            logger.info("Skipping indexing for this model")
+            return True
+
+    # Create encoder only once we know there is something to index
+    logger.info("Loading encoder...")
+    encoder = Encoder(model_name=model_id)
     
     try:
-        # Check current count
-        collection = client.collections.get(collection_name)
-        current_count = collection.aggregate.over_all(total_count=True).total_count
-        logger.info(f"Current objects in collection: {current_count}")
-        
-        if current_count > 0:
-            response = input(f"Collection already has {current_count} objects. Delete and re-index? (y/n): ")
-            if response.lower() == 'y':
-                logger.info("Deleting existing objects...")
-                client.collections.delete(collection_name)
-                create_schema_if_not_exists(collection_name)
-            else:
-                logger.info("Skipping indexing for this model")
-                return True
-        
-        # Prepare objects for batch insert
-        logger.info("Preparing objects for batch insert...")
-        objects = []
-        for i, (img, vector) in enumerate(zip(images, vectors)):
-            species = img['species']
-            # Enrich with species knowledge
-            extra_data = enrich_metadata_with_knowledge(species, {})
-            
-            # Create meaningful caption from species knowledge
-            knowledge = SPECIES_KNOWLEDGE.get(species, {})
-            species_name = species.replace('_', ' ')
-            distinctive = knowledge.get('distinctive_features', '')
-            caption = f"A {species_name}"
-            if distinctive:
-                caption += f" with {distinctive.split(',')[0]}"  # First feature
-            
-            obj = {
-                "properties": {
-                    "file": img['relative_path'],
-                    "caption": caption,
-                    "species": species,
-                    "extra": json.dumps(extra_data),
-                    "model_key": model_key
-                },
-                "vector": vector.tolist()
-            }
-            objects.append(obj)
-        
-        # Batch insert
-        logger.info(f"Inserting {len(objects)} objects in batches of {batch_size}...")
-        for i in tqdm(range(0, len(objects), batch_size), desc="Inserting batches"):
-            batch = objects[i:i+batch_size]
-            batch_add_objects(client, batch, batch_size=batch_size, collection_name=collection_name)
-        
-        # Verify
-        final_count = collection.aggregate.over_all(total_count=True).total_count
-        logger.info(f"✓ Indexing complete! Total objects: {final_count}")
-        
+        # Encode and insert as a stream: one batch context for the whole upload sends batches
+        # from its own workers while the next images are decoded and encoded
+        logger.info(f"Encoding and inserting {len(images)} objects in batches of {batch_size}...")
+        items = decoded if decoded is not None else [img['path'] for img in images]
+
+        uuids = make_uuids([img['relative_path'] for img in images], model_key)
+
+        def encoded_objects():
+            for start, batch_vectors in iter_encoded_batches(encoder, items, batch_size=16):
+                end = start + len(batch_vectors)
+                for img, vector, obj_uuid in zip(images[start:end], batch_vectors, uuids[start:end]):
+                    yield build_object(img, vector, model_key, obj_uuid)
+
+        added = bulk_ingest(client, encoded_objects(), collection_name, batch_size=batch_size,
+                            concurrent_requests=settings.WEAVIATE_CONCURRENT_REQUESTS)
+
+        # Expected total from the pre-count; the server-side count only runs with --verify
+        expected_count = current_count + added
+        if verify:
+            final_count = collection.aggregate.over_all(total_count=True).total_count
+            logger.info(f"✓ Indexing complete! Total objects: {final_count} (expected {expected_count})")
+        else:
+            logger.info(f"✓ Indexing complete! Expected total objects: {expected_count}")
     finally:
-        client.close()
-    
-    # Clear GPU memory
-    del encoder
-    import torch
-    if torch.cuda.is_available():
-        torch.cuda.empty_cache()
+        # Clear GPU memory, also when indexing fails part-way
+        release_encoder(encoder)
+        del encoder
+        gc.collect()
+        release_gpu_cache()
     
     return True
 
@@ -179,11 +256,13 @@ def main():
                         help="Model key to use (clip-base-p32, clip-base-p16, or 'all')")
     parser.add_argument("--batch-size", type=int, default=64,
                         help="Batch size for Weaviate insert")
+    parser.add_argument("--verify", action="store_true",
+                        help="Count objects on the server after indexing (extra aggregate query)")
     args = parser.parse_args()
     
     # Get all images
     logger.info("Scanning for images...")
-    images = get_all_images(DATA_DIR)
+    images = list(get_all_images(DATA_DIR))
     logger.info(f"Found {len(images)} images")
     
     if len(images) == 0:
@@ -201,11 +280,14 @@ def main():
         logger.info(f"  {species}: {count}")
     
     # Index
+    client = get_shared_client()
     if args.model == "all":
+        # decode once and feed the same images to every model
+        decoded = decode_all([img['path'] for img in images])
         for model_key in settings.AVAILABLE_MODELS.keys():
-            index_model(model_key, images, args.batch_size)
+            index_model(model_key, images, args.batch_size, decoded=decoded, client=client, verify=args.verify)
     else:
-        index_model(args.model, images, args.batch_size)
+        index_model(args.model, images, args.batch_size, client=client, verify=args.verify)
     
     logger.info("Done!")
 
@@ -7,6 +7,7 @@ Measures encoding and search times for different operations
 import sys
 import os
 import time
+import argparse
 import numpy as np
 from pathlib import Path
 
@@ -14,15 +15,29 @@ from pathlib import Path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.encoder import Encoder
-from app.weaviate_client import get_weaviate_client
+from app.weaviate_client import get_shared_client
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 
+BATCH_SIZE = 32
+BACKEND = None  # encoder backend override (--backend); None uses settings.ENCODER_BACKEND
+SEARCH_CONCURRENCY = 8
 
-def test_text_encoding_speed(model_name="openai/clip-vit-base-patch32", num_samples=100):
+
+def _ms(ns):
+    return ns / 1e6
+
+
+def _batches(items, batch_size):
+    for i in range(0, len(items), batch_size):
+        yield items[i:i + batch_size]
+
+
+def test_text_encoding_speed(model_name="openai/clip-vit-base-patch32", num_samples=100, batch_size=BATCH_SIZE):
     """Test text encoding speed"""
     print(f"\n=== Testing Text Encoding Speed ({model_name}) ===")
     
-    encoder = Encoder(model_name=model_name)
+    encoder = Encoder(backend=BACKEND, model_name=model_name)
     
     test_queries = [
         "cute cat sleeping",
@@ -35,38 +50,45 @@ def test_text_encoding_speed(model_name="openai/clip-vit-base-patch32", num_samp
         "sheep on hillside"
     ]
     
-    times = []
-    for i in range(num_samples):
-        query = test_queries[i % len(test_queries)]
-        
-        start = time.time()
-        embedding = encoder.encode_text([query])
-        elapsed = time.time() - start
-        
-        times.append(elapsed * 1000)  # Convert to milliseconds
+    queries = [test_queries[i % len(test_queries)] for i in range(num_samples)]
+    encoder.encode_text(queries[:batch_size])  # warmup
     
-    print(f"Samples: {num_samples}")
-    print(f"Average: {np.mean(times):.2f}ms")
+    # per-sample cost of each batched call (batch time / batch size)
+    times = []
+    total_ns = 0
+    for batch in _batches(queries, batch_size):
+        start = time.perf_counter_ns()
+        embedding = encoder.encode_text(batch)
+        elapsed = time.perf_counter_ns() - start
+        total_ns += elapsed
+        times.append(_ms(elapsed) / len(batch))
+    throughput = num_samples / (total_ns / 1e9)
+    
+    print(f"Samples: {num_samples} (batch size {batch_size})")
+    print(f"Average: {np.mean(times):.2f}ms per sample")
     print(f"Min: {np.min(times):.2f}ms")
     print(f"Max: {np.max(times):.2f}ms")
     print(f"Std Dev: {np.std(times):.2f}ms")
+    print(f"Throughput: {throughput:.1f} samples/s")
     
     return {
         "operation": "text_encoding",
         "model": model_name,
         "samples": num_samples,
+        "batch_size": batch_size,
         "avg_ms": np.mean(times),
         "min_ms": np.min(times),
         "max_ms": np.max(times),
-        "std_ms": np.std(times)
+        "std_ms": np.std(times),
+        "samples_per_s": throughput
     }
 
 
-def test_image_encoding_speed(model_name="openai/clip-vit-base-patch32", num_samples=50):
+def test_image_encoding_speed(model_name="openai/clip-vit-base-patch32", num_samples=50, batch_size=BATCH_SIZE):
     """Test image encoding speed"""
     print(f"\n=== Testing Image Encoding Speed ({model_name}) ===")
     
-    encoder = Encoder(model_name=model_name)
+    encoder = Encoder(backend=BACKEND, model_name=model_name)
     
     # Find test images
     data_dir = Path("data/full")
@@ -85,91 +107,102 @@ def test_image_encoding_speed(model_name="openai/clip-vit-base-patch32", num_sam
         print("ERROR: No test images found!")
         return None
     
-    times = []
+    images = []
     for img_path in test_images:
         try:
-            img = Image.open(img_path).convert('RGB')
-            
-            start = time.time()
-            embedding = encoder.encode_images([img])
-            elapsed = time.time() - start
-            
-            times.append(elapsed * 1000)  # Convert to milliseconds
+            images.append(Image.open(img_path).convert('RGB'))
         except Exception as e:
             print(f"Error processing {img_path}: {e}")
+    if not images:
+        print("ERROR: No readable test images!")
+        return None
+    encoder.encode_images(images[:batch_size])  # warmup
     
-    print(f"Samples: {len(times)}")
-    print(f"Average: {np.mean(times):.2f}ms")
+    # per-sample cost of each batched call (batch time / batch size)
+    times = []
+    total_ns = 0
+    for batch in _batches(images, batch_size):
+        start = time.perf_counter_ns()
+        embedding = encoder.encode_images(batch)
+        elapsed = time.perf_counter_ns() - start
+        total_ns += elapsed
+        times.append(_ms(elapsed) / len(batch))
+    throughput = len(images) / (total_ns / 1e9)
+    
+    print(f"Samples: {len(images)} (batch size {batch_size})")
+    print(f"Average: {np.mean(times):.2f}ms per sample")
     print(f"Min: {np.min(times):.2f}ms")
     print(f"Max: {np.max(times):.2f}ms")
     print(f"Std Dev: {np.std(times):.2f}ms")
+    print(f"Throughput: {throughput:.1f} samples/s")
     
     return {
         "operation": "image_encoding",
         "model": model_name,
-        "samples": len(times),
+        "samples": len(images),
+        "batch_size": batch_size,
         "avg_ms": np.mean(times),
         "min_ms": np.min(times),
         "max_ms": np.max(times),
-        "std_ms": np.std(times)
+        "std_ms": np.std(times),
+        "samples_per_s": throughput
     }
 
 
-def test_search_speed(collection_name="AnimalImageClipBase", num_samples=100):
+def test_search_speed(collection_name="AnimalImageClipBase", num_samples=100, concurrency=SEARCH_CONCURRENCY):
     """Test Weaviate search speed"""
     print(f"\n=== Testing Search Speed ({collection_name}) ===")
     
-    client = get_weaviate_client()
-    encoder = Encoder(model_name="openai/clip-vit-base-patch32")
+    client = get_shared_client()
+    encoder = Encoder(backend=BACKEND, model_name="openai/clip-vit-base-patch32")
     
     test_queries = [
         "cute cat", "brown dog", "flying bird", "large elephant",
         "colorful butterfly", "running horse", "white sheep", "black cow"
     ]
     
-    times = []
-    for i in range(num_samples):
-        query = test_queries[i % len(test_queries)]
-        
-        # Encode query
-        query_vector = encoder.encode_text([query])[0]
-        
-        # Time the search only
-        start = time.time()
-        collection = client.collections.get(collection_name)
-        response = collection.query.near_vector(
-            near_vector=query_vector.tolist(),
-            limit=20
-        )
-        elapsed = time.time() - start
-        
-        times.append(elapsed * 1000)  # Convert to milliseconds
+    # Encode all queries up front in one batch; only the searches are timed
+    queries = [test_queries[i % len(test_queries)] for i in range(num_samples)]
+    query_vectors = encoder.encode_text(queries)
+    collection = client.collections.get(collection_name)
     
-    client.close()
+    def timed_search(query_vector):
+        start = time.perf_counter_ns()
+        collection.query.near_vector(near_vector=query_vector, limit=20)
+        return _ms(time.perf_counter_ns() - start)
     
-    print(f"Samples: {num_samples}")
+    # concurrent searches: per-query latency plus overall QPS
+    start = time.perf_counter_ns()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        times = list(pool.map(timed_search, query_vectors))
+    qps = num_samples / ((time.perf_counter_ns() - start) / 1e9)
+    
+    print(f"Samples: {num_samples} (concurrency {concurrency})")
     print(f"Average: {np.mean(times):.2f}ms")
     print(f"Min: {np.min(times):.2f}ms")
     print(f"Max: {np.max(times):.2f}ms")
     print(f"Std Dev: {np.std(times):.2f}ms")
+    print(f"Throughput: {qps:.1f} queries/s")
     
     return {
         "operation": "weaviate_search",
         "collection": collection_name,
         "samples": num_samples,
+        "concurrency": concurrency,
         "avg_ms": np.mean(times),
         "min_ms": np.min(times),
         "max_ms": np.max(times),
-        "std_ms": np.std(times)
+        "std_ms": np.std(times),
+        "queries_per_s": qps
     }
 
 
-def test_end_to_end(num_samples=50):
+def test_end_to_end(num_samples=50, batch_size=BATCH_SIZE, concurrency=SEARCH_CONCURRENCY):
     """Test complete end-to-end text search"""
     print(f"\n=== Testing End-to-End Text Search ===")
     
-    client = get_weaviate_client()
-    encoder = Encoder(model_name="openai/clip-vit-base-patch32")
+    client = get_shared_client()
+    encoder = Encoder(backend=BACKEND, model_name="openai/clip-vit-base-patch32")
     
     test_queries = [
         "cute cat sleeping on sofa",
@@ -179,49 +212,40 @@ def test_end_to_end(num_samples=50):
         "colorful butterfly on flower"
     ]
     
-    total_times = []
-    encode_times = []
-    search_times = []
-    
-    for i in range(num_samples):
-        query = test_queries[i % len(test_queries)]
-        
-        # Total time
-        start_total = time.time()
-        
-        # Encode time
-        start_encode = time.time()
-        query_vector = encoder.encode_text([query])[0]
-        encode_time = time.time() - start_encode
-        
-        # Search time
-        start_search = time.time()
-        collection = client.collections.get("AnimalImageClipBase")
-        response = collection.query.near_vector(
-            near_vector=query_vector.tolist(),
-            limit=20
-        )
-        search_time = time.time() - start_search
-        
-        total_time = time.time() - start_total
-        
-        total_times.append(total_time * 1000)
-        encode_times.append(encode_time * 1000)
-        search_times.append(search_time * 1000)
+    queries = [test_queries[i % len(test_queries)] for i in range(num_samples)]
+    collection = client.collections.get("AnimalImageClipBase")
     
-    client.close()
+    def timed_search(query_vector):
+        start = time.perf_counter_ns()
+        collection.query.near_vector(near_vector=query_vector, limit=20)
+        return _ms(time.perf_counter_ns() - start)
     
-    print(f"Samples: {num_samples}")
-    print(f"Total Average: {np.mean(total_times):.2f}ms")
-    print(f"  - Encode: {np.mean(encode_times):.2f}ms")
-    print(f"  - Search: {np.mean(search_times):.2f}ms")
+    # each batch: one batched encode, then its searches run concurrently
+    encode_times = []
+    search_times = []
+    start_total = time.perf_counter_ns()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for batch in _batches(queries, batch_size):
+            start_encode = time.perf_counter_ns()
+            query_vectors = encoder.encode_text(batch)
+            encode_times.append(_ms(time.perf_counter_ns() - start_encode) / len(batch))
+            search_times.extend(pool.map(timed_search, query_vectors))
+    total_ns = time.perf_counter_ns() - start_total
+    total_per_sample = _ms(total_ns) / num_samples
+    
+    print(f"Samples: {num_samples} (batch size {batch_size}, concurrency {concurrency})")
+    print(f"Total Average: {total_per_sample:.2f}ms per query")
+    print(f"  - Encode: {np.mean(encode_times):.2f}ms per query")
+    print(f"  - Search: {np.mean(search_times):.2f}ms latency")
+    print(f"Throughput: {num_samples / (total_ns / 1e9):.1f} queries/s")
     
     return {
         "operation": "end_to_end_text_search",
         "samples": num_samples,
-        "total_avg_ms": np.mean(total_times),
+        "total_avg_ms": total_per_sample,
         "encode_avg_ms": np.mean(encode_times),
-        "search_avg_ms": np.mean(search_times)
+        "search_avg_ms": np.mean(search_times),
+        "queries_per_s": num_samples / (total_ns / 1e9)
     }
 
 
@@ -274,6 +298,7 @@ def run_all_tests():
     print("="*60)
     print(f"Date: {time.strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"Python: {sys.version.split()[0]}")
+    print(f"Backend: {BACKEND or os.getenv('ENCODER_BACKEND', 'hf_clip')}")
     
     results = []
     
@@ -294,6 +319,12 @@ def run_all_tests():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Image retrieval performance tests")
+    parser.add_argument("--backend", choices=["hf_clip", "onnx", "sentence_transformers"], default=None,
+                        help="Encoder backend to measure (default: ENCODER_BACKEND)")
+    args = parser.parse_args()
+    BACKEND = args.backend
+    
     try:
         results = run_all_tests()
         